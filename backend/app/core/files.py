@@ -0,0 +1,16 @@
+from collections.abc import Callable
+from pathlib import Path
+from uuid import uuid4
+
+
+def write_atomic(path: Path, write: Callable[[Path], object]) -> None:
+    # ``write`` fills a temporary file next to ``path`` which then replaces it,
+    # so readers (including other processes, and ones that memory-mapped the
+    # old file) see either the old or the new file, never a partial one.
+    tmp_path = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+    try:
+        write(tmp_path)
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -14,6 +14,24 @@ class Settings(BaseSettings):
     sample_docs_dir: str = "../samples"
     ocr_languages: list[str] = ["en", "hr"]
     ocr_min_text_length: int = 100
+    ocr_batch_size: int = 8
+    ocr_mode: str = "page"
+    ocr_region_dpi: int = 200
+    ocr_region_min_size: int = 32
+    ocr_load_on_startup: bool = False
+    ocr_cache_backend: str = "redis"
+    ocr_cache_dir: str = "./storage/ocr_cache"
+    extraction_workers: int = 1
+    extraction_pages_per_task: int = 8
+    extraction_commit_pages: int = 25
+    extraction_embed_chunks: bool = False
+    chunk_strategy: str = "fixed"
+    chunk_size: int = 500
+    chunk_overlap: int = 50
+    chunk_tokenizer: str = "cl100k_base"
+    chunk_max_tokens: int = 200
+    chunk_overlap_tokens: int = 20
+    chunk_across_pages: bool = False
     qa_model_preset: str = "best"
     qa_model_name: str = "deepset/xlm-roberta-large-squad2"
     qa_distilbert_model_name: str = "distilbert-base-cased-distilled-squad"
@@ -21,8 +39,35 @@ class Settings(BaseSettings):
     qa_top_k: int = 10
     qa_max_context_chars: int = 4000
     embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embedding_backend: str = "torch"
+    embedding_onnx_file: str = ""
+    embedding_onnx_int8_file: str = "onnx/model_quint8_avx2.onnx"
+    embedding_parity_min_cosine: float = 0.99
+    embedding_load_on_startup: bool = False
+    embedding_batch_size: int = 32
+    embedding_workers: int = 1
+    embedding_pool_shard_size: int = 256
+    embedding_query_batch_window_ms: float = 0
+    embedding_query_batch_size: int = 32
     faiss_index_dir: str = "./storage/faiss"
+    faiss_cache_bytes: int = 256 * 1024 * 1024
+    faiss_mmap: bool = False
+    faiss_index_type: str = "auto"
+    faiss_hnsw_threshold: int = 10_000
+    faiss_ivf_threshold: int = 100_000
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_construction: int = 80
+    faiss_hnsw_ef_search: int = 64
+    faiss_ivf_nlist: int = 0
+    faiss_ivf_nprobe: int = 16
+    faiss_compression: str = "none"
+    faiss_pq_m: int = 48
+    faiss_rerank_factor: int = 4
+    embedding_store_dir: str = "./storage/embeddings"
     redis_url: str = "redis://localhost:6379/0"
+    embedding_cache_dtype: str = "float32"
+    embedding_memory_cache_bytes: int = 32 * 1024 * 1024
+    embedding_memory_cache_ttl_seconds: float = 3600
     ner_default_model: str = "en_core_web_sm"
     ner_model_map: dict[str, str] = {"en": "en_core_web_sm", "hr": "hr_core_news_sm"}
     ner_auto_download: bool = True
@@ -21,6 +21,16 @@ def init_db() -> None:
     if not _has_column(engine, "documents", "language"):
         with engine.begin() as conn:
             conn.execute(text("ALTER TABLE documents ADD COLUMN language VARCHAR(16)"))
+    if not _has_column(engine, "documents", "extraction_checkpoint"):
+        _add_column(engine, "documents", "extraction_checkpoint INTEGER")
+    if not _has_column(engine, "documents", "content_hash"):
+        _add_column(engine, "documents", "content_hash VARCHAR(64)")
+    if not _has_column(engine, "documents", "extraction_fingerprint"):
+        _add_column(engine, "documents", "extraction_fingerprint VARCHAR(64)")
+    if not _has_column(engine, "documents", "source_document_id"):
+        _add_column(engine, "documents", "source_document_id INTEGER")
+    if not _has_column(engine, "document_pages", "fingerprint"):
+        _add_column(engine, "document_pages", "fingerprint VARCHAR(64)")
     chunks_changed = False
     if not _has_column(engine, "document_chunks", "start_offset"):
         _add_column(engine, "document_chunks", "start_offset INTEGER DEFAULT 0")
@@ -28,6 +38,8 @@ def init_db() -> None:
     if not _has_column(engine, "document_chunks", "end_offset"):
         _add_column(engine, "document_chunks", "end_offset INTEGER DEFAULT 0")
         chunks_changed = True
+    if not _has_column(engine, "document_chunks", "end_page_number"):
+        _add_column(engine, "document_chunks", "end_page_number INTEGER")
     if chunks_changed:
         with engine.begin() as conn:
             conn.execute(
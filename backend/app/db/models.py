@@ -23,6 +23,14 @@ class Document(Base):
     file_path: Mapped[str] = mapped_column(String(512))
     size_bytes: Mapped[int] = mapped_column()
     language: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    extraction_checkpoint: Mapped[int | None] = mapped_column(nullable=True)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    extraction_fingerprint: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    source_document_id: Mapped[int | None] = mapped_column(nullable=True, index=True)
+
+    @property
+    def content_document_id(self) -> int:
+        return self.source_document_id or self.id
 
 
 class DocumentPage(Base):
@@ -32,6 +40,7 @@ class DocumentPage(Base):
     document_id: Mapped[int] = mapped_column(index=True)
     page_number: Mapped[int] = mapped_column()
     text: Mapped[str] = mapped_column()
+    fingerprint: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
 
 class DocumentChunk(Base):
@@ -43,3 +52,4 @@ class DocumentChunk(Base):
     chunk_index: Mapped[int] = mapped_column()
     start_offset: Mapped[int] = mapped_column()
     end_offset: Mapped[int] = mapped_column()
+    end_page_number: Mapped[int | None] = mapped_column(nullable=True)
@@ -1,5 +1,5 @@
 from sqlalchemy import delete, distinct, func, select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 
 from app.db.models import Document, DocumentChunk, DocumentPage
 
@@ -18,7 +18,9 @@ class DocumentRepository:
         file_path: str,
         size_bytes: int,
         language: str | None = None,
+        content_hash: str | None = None,
     ) -> Document:
+        owner = self.get_content_owner(session, content_hash) if content_hash else None
         doc = Document(
             user_id=user_id,
             filename=filename,
@@ -26,6 +28,8 @@ class DocumentRepository:
             file_path=file_path,
             size_bytes=size_bytes,
             language=language,
+            content_hash=content_hash,
+            source_document_id=owner.id if owner else None,
         )
         session.add(doc)
         session.commit()
@@ -51,6 +55,115 @@ class DocumentRepository:
         session.add_all(pages + chunks)
         session.commit()
 
+    def begin_extraction(self, session: Session, document: Document, fingerprint: str) -> None:
+        # While a checkpoint is open the fingerprint belongs to the run in
+        # progress, so a resumed run can tell whether its settings match.
+        document.extraction_checkpoint = 0
+        document.extraction_fingerprint = fingerprint
+        session.add(document)
+        session.commit()
+
+    def add_extraction_batch(
+        self,
+        session: Session,
+        document: Document,
+        pages: list[DocumentPage],
+        chunks: list[DocumentChunk],
+        checkpoint: int | None,
+    ) -> None:
+        self._write_pages(session, document.id, pages, chunks)
+        document.extraction_checkpoint = checkpoint
+        session.add(document)
+        session.commit()
+
+    def complete_extraction(
+        self,
+        session: Session,
+        document: Document,
+        pages: list[DocumentPage],
+        chunks: list[DocumentChunk],
+        page_count: int,
+        fingerprint: str,
+    ) -> None:
+        self._write_pages(session, document.id, pages, chunks)
+        session.execute(
+            delete(DocumentPage).where(
+                DocumentPage.document_id == document.id,
+                DocumentPage.page_number > page_count,
+            )
+        )
+        session.execute(
+            delete(DocumentChunk).where(
+                DocumentChunk.document_id == document.id,
+                DocumentChunk.page_number > page_count,
+            )
+        )
+        document.extraction_checkpoint = None
+        document.extraction_fingerprint = fingerprint
+        session.add(document)
+        session.commit()
+
+    def _write_pages(
+        self,
+        session: Session,
+        document_id: int,
+        pages: list[DocumentPage],
+        chunks: list[DocumentChunk],
+    ) -> None:
+        page_numbers = [page.page_number for page in pages]
+        if page_numbers:
+            session.execute(
+                delete(DocumentPage).where(
+                    DocumentPage.document_id == document_id,
+                    DocumentPage.page_number.in_(page_numbers),
+                )
+            )
+            session.execute(
+                delete(DocumentChunk).where(
+                    DocumentChunk.document_id == document_id,
+                    DocumentChunk.page_number.in_(page_numbers),
+                )
+            )
+        session.add_all(pages + chunks)
+
+    def update_content_hash(self, session: Session, document: Document, content_hash: str) -> Document:
+        owner = self.get_content_owner(session, content_hash)
+        document.content_hash = content_hash
+        if owner and owner.id != document.id:
+            document.source_document_id = owner.id
+        session.add(document)
+        session.commit()
+        session.refresh(document)
+        return document
+
+    def get_content_owner(self, session: Session, content_hash: str) -> Document | None:
+        stmt = (
+            select(Document)
+            .where(Document.content_hash == content_hash, Document.source_document_id.is_(None))
+            .order_by(Document.id)
+            .limit(1)
+        )
+        return session.execute(stmt).scalar_one_or_none()
+
+    def get_content_document(self, session: Session, document: Document) -> Document:
+        if document.source_document_id is None:
+            return document
+        return session.get(Document, document.source_document_id) or document
+
+    def page_fingerprints(self, session: Session, document_id: int) -> dict[int, str | None]:
+        stmt = select(DocumentPage.page_number, DocumentPage.fingerprint).where(
+            DocumentPage.document_id == document_id
+        )
+        return {page_number: fingerprint for page_number, fingerprint in session.execute(stmt).all()}
+
+    def count_pages(self, session: Session, document_id: int) -> int:
+        stmt = select(func.count(DocumentPage.id)).where(DocumentPage.document_id == document_id)
+        return int(session.execute(stmt).scalar_one())
+
+    def count_chunks(self, session: Session, document_id: int) -> int:
+        stmt = select(func.count(DocumentChunk.id)).where(DocumentChunk.document_id == document_id)
+        return int(session.execute(stmt).scalar_one())
+
     def list_pages(self, session: Session, document_id: int) -> list[DocumentPage]:
         stmt = select(DocumentPage).where(DocumentPage.document_id == document_id)
         return list(session.execute(stmt).scalars().all())
@@ -59,6 +172,29 @@ class DocumentRepository:
         stmt = select(DocumentChunk).where(DocumentChunk.document_id == document_id)
         return list(session.execute(stmt).scalars().all())
 
+    def list_chunks_by_ids(self, session: Session, chunk_ids: list[int]) -> list[DocumentChunk]:
+        if not chunk_ids:
+            return []
+        stmt = select(DocumentChunk).where(DocumentChunk.id.in_(chunk_ids))
+        return list(session.execute(stmt).scalars().all())
+
+    def chunk_ids_by_document(self, session: Session, document_ids: list[int]) -> dict[int, list[int]]:
+        if not document_ids:
+            return {}
+        stmt = (
+            select(DocumentChunk.document_id, DocumentChunk.id)
+            .where(DocumentChunk.document_id.in_(document_ids))
+            .order_by(DocumentChunk.id)
+        )
+        chunk_ids: dict[int, list[int]] = {}
+        for document_id, chunk_id in session.execute(stmt).all():
+            chunk_ids.setdefault(document_id, []).append(chunk_id)
+        return chunk_ids
+
+    def list_for_user(self, session: Session, user_id: int) -> list[Document]:
+        stmt = select(Document).where(Document.user_id == user_id).order_by(Document.id)
+        return list(session.execute(stmt).scalars().all())
+
     def get_by_user_filename_and_size(
         self,
         session: Session,
@@ -77,16 +213,22 @@ class DocumentRepository:
         self,
         session: Session,
         user_id: int,
-    ) -> list[tuple[Document, int, int]]:
+    ) -> list[tuple[Document, int, int, bool]]:
+        owner = aliased(Document)
+        content_id = func.coalesce(Document.source_document_id, Document.id)
         pages_count = func.count(distinct(DocumentPage.id)).label("pages_count")
         chunks_count = func.count(distinct(DocumentChunk.id)).label("chunks_count")
+        checkpoint = func.max(
+            func.coalesce(owner.extraction_checkpoint, Document.extraction_checkpoint)
+        ).label("checkpoint")
         stmt = (
-            select(Document, pages_count, chunks_count)
-            .outerjoin(DocumentPage, DocumentPage.document_id == Document.id)
-            .outerjoin(DocumentChunk, DocumentChunk.document_id == Document.id)
+            select(Document, pages_count, chunks_count, checkpoint)
+            .outerjoin(owner, owner.id == Document.source_document_id)
+            .outerjoin(DocumentPage, DocumentPage.document_id == content_id)
+            .outerjoin(DocumentChunk, DocumentChunk.document_id == content_id)
             .where(Document.user_id == user_id)
             .group_by(Document.id)
             .order_by(Document.id.desc())
         )
         rows = session.execute(stmt).all()
-        return [(row[0], int(row[1] or 0), int(row[2] or 0)) for row in rows]
+        return [(row[0], int(row[1] or 0), int(row[2] or 0), row[3] is not None) for row in rows]
@@ -40,6 +40,14 @@ def create_app() -> FastAPI:
         ner_models = set(settings.ner_model_map.values())
         ner_models.add(settings.ner_default_model)
         ensure_models_available(ner_models, auto_download=settings.ner_auto_download)
+        if settings.ocr_load_on_startup:
+            from app.services.ocr_service import OCRService
+
+            OCRService().load()
+        if settings.embedding_load_on_startup:
+            from app.services.embedding_service import EmbeddingService
+
+            EmbeddingService().warmup()
         if settings.qa_load_on_startup:
             from app.services.qa_service import QAService
 
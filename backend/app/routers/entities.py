@@ -26,7 +26,7 @@ def list_entities(
     if not document:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
-    pages = repo.list_pages(session, document_id)
+    pages = repo.list_pages(session, document.content_document_id)
     if not pages:
         return EntitiesResponse(document_id=document_id, entities=[])
 
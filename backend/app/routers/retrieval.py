@@ -3,21 +3,23 @@ from sqlalchemy.orm import Session
 
 from app.db.repos.documents import DocumentRepository
 from app.db.session import get_session
-from app.schemas.retrieval import RetrievalRequest, RetrievalResponse, RetrievalResultResponse
+from app.schemas.retrieval import (
+    LibrarySearchRequest,
+    LibrarySearchResponse,
+    LibrarySearchResultResponse,
+    RetrievalRequest,
+    RetrievalResponse,
+    RetrievalResultResponse,
+)
 from app.services.current_user import get_current_user
 from app.services.embedding_service import EmbeddingService
-from app.services.faiss_service import FaissService
 from app.services.retrieval_service import RetrievalService
 
 router = APIRouter()
 
 
 def get_retrieval_service() -> RetrievalService:
-    return RetrievalService(
-        DocumentRepository(),
-        embedding_service=EmbeddingService(),
-        faiss_service=FaissService(),
-    )
+    return RetrievalService(DocumentRepository(), embedding_service=EmbeddingService())
 
 
 @router.post("/documents/{document_id}/search", response_model=RetrievalResponse)
@@ -52,3 +54,32 @@ def search_document(
             for result in results
         ],
     )
+
+
+@router.post("/search", response_model=LibrarySearchResponse)
+def search_library(
+    payload: LibrarySearchRequest,
+    session: Session = Depends(get_session),
+    current_user=Depends(get_current_user),
+    service: RetrievalService = Depends(get_retrieval_service),
+) -> LibrarySearchResponse:
+    results = service.retrieve_library(
+        session,
+        current_user.id,
+        payload.query,
+        top_k=payload.top_k,
+        min_score=payload.min_score,
+        document_ids=payload.document_ids,
+    )
+    return LibrarySearchResponse(
+        results=[
+            LibrarySearchResultResponse(
+                document_id=result.document_id,
+                page_number=result.page_number,
+                chunk_index=result.chunk_index,
+                snippet=result.snippet,
+                score=result.score,
+            )
+            for result in results
+        ]
+    )
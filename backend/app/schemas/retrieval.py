@@ -18,3 +18,18 @@ class RetrievalResultResponse(BaseModel):
 class RetrievalResponse(BaseModel):
     document_id: int
     results: list[RetrievalResultResponse]
+
+
+class LibrarySearchRequest(BaseModel):
+    query: str
+    top_k: int = 3
+    min_score: float = 0.0
+    document_ids: list[int] | None = None
+
+
+class LibrarySearchResultResponse(RetrievalResultResponse):
+    document_id: int
+
+
+class LibrarySearchResponse(BaseModel):
+    results: list[LibrarySearchResultResponse]
@@ -0,0 +1,249 @@
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Protocol
+
+import tiktoken
+
+from app.core.settings import Settings, get_settings
+from app.db.models import DocumentChunk, DocumentPage
+
+_SENTENCE_RE = re.compile(r"\S.*?(?:[.!?](?=\s|$)|\n\s*\n|$)", re.S)
+
+
+@dataclass(frozen=True)
+class ChunkSpan:
+    page_number: int
+    chunk_index: int
+    start_offset: int
+    end_offset: int
+    end_page_number: int | None = None
+
+
+class Tokenizer(Protocol):
+    def token_offsets(self, text: str) -> list[int]: ...
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding_name: str) -> None:
+        self.encoding_name = encoding_name
+        self._encoding: tiktoken.Encoding | None = None
+
+    def _get_encoding(self) -> tiktoken.Encoding:
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def token_offsets(self, text: str) -> list[int]:
+        encoding = self._get_encoding()
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        return offsets
+
+
+class Chunker(Protocol):
+    def add_page(self, page_number: int, text: str) -> list[ChunkSpan]: ...
+
+    def finish(self) -> list[ChunkSpan]: ...
+
+    @property
+    def pending_page(self) -> int | None: ...
+
+
+class FixedChunker:
+    def __init__(self, size: int, overlap: int) -> None:
+        self.size = size
+        self.overlap = overlap
+
+    @property
+    def pending_page(self) -> int | None:
+        return None
+
+    def add_page(self, page_number: int, text: str) -> list[ChunkSpan]:
+        return [
+            ChunkSpan(page_number=page_number, chunk_index=chunk_index, start_offset=start, end_offset=end)
+            for chunk_index, (start, end) in enumerate(chunk_ranges(text, self.size, self.overlap))
+        ]
+
+    def finish(self) -> list[ChunkSpan]:
+        return []
+
+
+@dataclass(frozen=True)
+class _Unit:
+    page_number: int
+    start: int
+    end: int
+    tokens: int
+
+
+class SentenceChunker:
+    # Packs whole sentences into chunks of at most ``max_tokens`` tokens and
+    # repeats up to ``overlap_tokens`` worth of trailing sentences at the start
+    # of the next chunk. Sentences longer than the budget are split on token
+    # boundaries. With ``across_pages`` the open chunk carries over into the
+    # next page instead of being closed at every page break.
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        max_tokens: int,
+        overlap_tokens: int = 0,
+        across_pages: bool = False,
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.max_tokens = max(max_tokens, 1)
+        self.overlap_tokens = min(max(overlap_tokens, 0), self.max_tokens - 1)
+        self.across_pages = across_pages
+        self._buffer: list[_Unit] = []
+        self._fresh_from = 0
+        self._next_index: dict[int, int] = {}
+
+    @property
+    def pending_page(self) -> int | None:
+        if self._fresh_from >= len(self._buffer):
+            return None
+        return self._buffer[self._fresh_from].page_number
+
+    def add_page(self, page_number: int, text: str) -> list[ChunkSpan]:
+        spans: list[ChunkSpan] = []
+        for unit in self._sentence_units(page_number, text):
+            if self._buffer and self._buffer_tokens() + unit.tokens > self.max_tokens:
+                spans.extend(self._emit())
+                self._keep_overlap(unit.tokens)
+            self._buffer.append(unit)
+        if not self.across_pages:
+            spans.extend(self._emit())
+            self._buffer = []
+            self._fresh_from = 0
+        return spans
+
+    def finish(self) -> list[ChunkSpan]:
+        spans = self._emit()
+        self._buffer = []
+        self._fresh_from = 0
+        return spans
+
+    def _buffer_tokens(self) -> int:
+        return sum(unit.tokens for unit in self._buffer)
+
+    def _emit(self) -> list[ChunkSpan]:
+        if self._fresh_from >= len(self._buffer):
+            return []
+        first, last = self._buffer[0], self._buffer[-1]
+        chunk_index = self._next_index.get(first.page_number, 0)
+        self._next_index[first.page_number] = chunk_index + 1
+        self._fresh_from = len(self._buffer)
+        return [
+            ChunkSpan(
+                page_number=first.page_number,
+                chunk_index=chunk_index,
+                start_offset=first.start,
+                end_offset=last.end,
+                end_page_number=last.page_number if last.page_number != first.page_number else None,
+            )
+        ]
+
+    def _keep_overlap(self, incoming_tokens: int) -> None:
+        budget = min(self.overlap_tokens, self.max_tokens - incoming_tokens)
+        kept: list[_Unit] = []
+        total = 0
+        for unit in reversed(self._buffer):
+            if total + unit.tokens > budget:
+                break
+            kept.insert(0, unit)
+            total += unit.tokens
+        self._buffer = kept
+        self._fresh_from = len(kept)
+
+    def _sentence_units(self, page_number: int, text: str) -> Iterable[_Unit]:
+        for match in _SENTENCE_RE.finditer(text):
+            start, end = match.start(), match.end()
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end <= start:
+                continue
+            offsets = self.tokenizer.token_offsets(text[start:end])
+            if len(offsets) <= self.max_tokens:
+                yield _Unit(page_number, start, end, max(len(offsets), 1))
+                continue
+            for first in range(0, len(offsets), self.max_tokens):
+                piece_start = start + offsets[first]
+                following = first + self.max_tokens
+                piece_end = start + offsets[following] if following < len(offsets) else end
+                while piece_end > piece_start and text[piece_end - 1].isspace():
+                    piece_end -= 1
+                if piece_end > piece_start:
+                    yield _Unit(page_number, piece_start, piece_end, min(self.max_tokens, len(offsets) - first))
+
+
+def chunking_signature(settings: Settings | None = None) -> str:
+    settings = settings or get_settings()
+    if settings.chunk_strategy == "sentence":
+        return (
+            f"sentence:{settings.chunk_tokenizer}:{settings.chunk_max_tokens}/{settings.chunk_overlap_tokens}"
+            f":across_pages={settings.chunk_across_pages}"
+        )
+    return f"fixed:{settings.chunk_size}/{settings.chunk_overlap}"
+
+
+def create_chunker(settings: Settings | None = None, tokenizer: Tokenizer | None = None) -> Chunker:
+    settings = settings or get_settings()
+    if settings.chunk_strategy == "sentence":
+        return SentenceChunker(
+            tokenizer or TiktokenTokenizer(settings.chunk_tokenizer),
+            max_tokens=settings.chunk_max_tokens,
+            overlap_tokens=settings.chunk_overlap_tokens,
+            across_pages=settings.chunk_across_pages,
+        )
+    if settings.chunk_strategy != "fixed":
+        raise ValueError(f"Unknown chunk strategy: {settings.chunk_strategy}")
+    return FixedChunker(settings.chunk_size, settings.chunk_overlap)
+
+
+def chunk_ranges(text: str, size: int = 500, overlap: int = 50) -> Iterable[tuple[int, int]]:
+    if size <= 0:
+        return []
+    if overlap >= size:
+        overlap = 0
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = min(start + size, text_length)
+        if end > start:
+            yield start, end
+        if end == text_length:
+            break
+        start = end - overlap
+
+
+def chunk_texts(
+    chunks: list[DocumentChunk],
+    page_map: dict[int, DocumentPage],
+) -> tuple[list[DocumentChunk], list[str]]:
+    # Chunks whose page is missing are left out.
+    kept: list[DocumentChunk] = []
+    texts: list[str] = []
+    for chunk in chunks:
+        snippet = chunk_text(chunk, page_map)
+        if snippet is None:
+            continue
+        kept.append(chunk)
+        texts.append(snippet)
+    return kept, texts
+
+
+def chunk_text(chunk: DocumentChunk, page_map: dict[int, DocumentPage]) -> str | None:
+    page = page_map.get(chunk.page_number)
+    if not page:
+        return None
+    end_page_number = chunk.end_page_number or chunk.page_number
+    if end_page_number == chunk.page_number:
+        return page.text[chunk.start_offset:chunk.end_offset]
+    parts = [page.text[chunk.start_offset:]]
+    for page_number in range(chunk.page_number + 1, end_page_number):
+        middle = page_map.get(page_number)
+        if middle:
+            parts.append(middle.text)
+    last = page_map.get(end_page_number)
+    if last:
+        parts.append(last.text[:chunk.end_offset])
+    return "\n".join(parts)
@@ -1,12 +1,13 @@
+import hashlib
 import shutil
 from dataclasses import dataclass
 from pathlib import Path
-from uuid import uuid4
 
 import fitz
 from fastapi import UploadFile
 from sqlalchemy.orm import Session
 
+from app.core.files import write_atomic
 from app.core.settings import get_settings
 from app.db.models import Document
 from app.db.repos.documents import DocumentRepository
@@ -18,9 +19,12 @@ class DocumentLibraryItem:
     document: Document
     pages_count: int
     chunks_count: int
+    in_progress: bool = False
 
     @property
     def extraction_status(self) -> str:
+        if self.in_progress:
+            return "partial"
         return "extracted" if self.pages_count > 0 else "pending"
 
 
@@ -38,14 +42,17 @@ class DocumentService:
         storage_root = Path(settings.storage_dir)
         storage_root.mkdir(parents=True, exist_ok=True)
 
-        file_id = uuid4().hex
-        extension = Path(upload.filename or "upload").suffix
-        target_path = storage_root / f"{file_id}{extension}"
-
         content = upload.file.read()
-        target_path.write_bytes(content)
+        content_hash = hashlib.sha256(content).hexdigest()
+        extension = Path(upload.filename or "upload").suffix
+        target_path = storage_root / f"{content_hash}{extension}"
+        if not target_path.exists():
+            # Files are shared by content hash, so concurrent uploads of the same
+            # bytes must never observe a half-written file.
+            write_atomic(target_path, lambda tmp_path: tmp_path.write_bytes(content))
 
-        language = self._detect_language(upload, target_path)
+        owner = self.repo.get_content_owner(session, content_hash)
+        language = owner.language if owner else self._detect_language(upload, target_path)
 
         return self.repo.create(
             session=session,
@@ -55,6 +62,7 @@ class DocumentService:
             file_path=str(target_path),
             size_bytes=len(content),
             language=language,
+            content_hash=content_hash,
         )
 
     def list_documents_for_user(self, session: Session, user_id: int) -> list[DocumentLibraryItem]:
@@ -64,8 +72,9 @@ class DocumentService:
                 document=document,
                 pages_count=pages_count,
                 chunks_count=chunks_count,
+                in_progress=in_progress,
             )
-            for document, pages_count, chunks_count in rows
+            for document, pages_count, chunks_count, in_progress in rows
         ]
 
     def import_sample_documents(self, session: Session, user_id: int) -> int:
@@ -89,9 +98,12 @@ class DocumentService:
             if existing:
                 continue
 
-            target_path = storage_root / f"{uuid4().hex}{sample_path.suffix}"
-            shutil.copyfile(sample_path, target_path)
-            language = self._detect_language_for_pdf(target_path)
+            content_hash = compute_content_hash(sample_path)
+            target_path = storage_root / f"{content_hash}{sample_path.suffix}"
+            if not target_path.exists():
+                write_atomic(target_path, lambda tmp_path: shutil.copyfile(sample_path, tmp_path))
+            owner = self.repo.get_content_owner(session, content_hash)
+            language = owner.language if owner else self._detect_language_for_pdf(target_path)
             self.repo.create(
                 session=session,
                 user_id=user_id,
@@ -100,6 +112,7 @@ class DocumentService:
                 file_path=str(target_path),
                 size_bytes=size_bytes,
                 language=language,
+                content_hash=content_hash,
             )
             created += 1
         return created
@@ -130,3 +143,11 @@ class DocumentService:
         except Exception:
             return None
         return self.language_service.detect_language(text)
+
+
+def compute_content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,84 @@
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+import numpy as np
+
+
+class QueryBatcher:
+    # Collects texts submitted by concurrent requests and encodes them in one
+    # call. A batch is sent once it holds ``max_batch_size`` texts or the first
+    # text in it has waited ``window_seconds``.
+    def __init__(
+        self,
+        encode: Callable[[list[str]], np.ndarray],
+        max_batch_size: int = 32,
+        window_seconds: float = 0.005,
+    ) -> None:
+        self.encode = encode
+        self.max_batch_size = max(max_batch_size, 1)
+        self.window_seconds = max(window_seconds, 0.0)
+        self.batches = 0
+        self.texts = 0
+        self._pending: list[tuple[str, Future]] = []
+        self._condition = Condition()
+        self._thread: Thread | None = None
+        self._closed = False
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Query batcher is closed")
+            self._pending.append((text, future))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="embedding-query-batcher", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def close(self) -> None:
+        # Texts already submitted are still encoded.
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.window_seconds
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[: self.max_batch_size]
+                del self._pending[: self.max_batch_size]
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list[tuple[str, Future]]) -> None:
+        try:
+            vectors = self.encode([text for text, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        self.batches += 1
+        self.texts += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
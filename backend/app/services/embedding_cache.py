@@ -1,31 +1,186 @@
 import json
 import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from threading import Lock
 
+import numpy as np
 from redis import Redis
+from redis.exceptions import RedisError
 
 from app.core.settings import get_settings
 
+# Payloads are a version byte, a dtype code and the raw little-endian vector.
+# Entries written by older releases as JSON lists are still readable.
+_FORMAT_VERSION = 1
+_DTYPES = {"float32": (b"f", np.dtype("<f4")), "float16": (b"e", np.dtype("<f2"))}
+_DTYPE_BY_CODE = {code: dtype for code, dtype in _DTYPES.values()}
+
+
+class MemoryTier:
+    # LRU of decoded vectors bounded by their total size in bytes. Entries older
+    # than ``ttl_seconds`` are dropped on access; ``0`` keeps them until evicted.
+    def __init__(self, max_bytes: int, ttl_seconds: float = 0) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size_bytes = 0
+        self._entries: OrderedDict[str, tuple[np.ndarray, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, expires_at = entry
+            if expires_at and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def set(self, key: str, vector: np.ndarray) -> None:
+        vector = np.array(vector, dtype=np.float32)
+        if vector.nbytes > self.max_bytes:
+            return
+        vector.flags.writeable = False
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (vector, expires_at)
+            self.size_bytes += vector.nbytes
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        vector, _ = self._entries.pop(key)
+        self.size_bytes -= vector.nbytes
+
 
 class EmbeddingCache:
-    def __init__(self, redis_url: str | None = None) -> None:
+    def __init__(
+        self,
+        redis_url: str | None = None,
+        dtype: str | None = None,
+        memory_bytes: int | None = None,
+        memory_ttl_seconds: float | None = None,
+    ) -> None:
         settings = get_settings()
         self.redis_url = redis_url or settings.redis_url
+        self.dtype = dtype or settings.embedding_cache_dtype
+        if self.dtype not in _DTYPES:
+            raise ValueError(f"Unknown embedding cache dtype: {self.dtype}")
+        memory_bytes = settings.embedding_memory_cache_bytes if memory_bytes is None else memory_bytes
+        if memory_ttl_seconds is None:
+            memory_ttl_seconds = settings.embedding_memory_cache_ttl_seconds
+        self.memory = MemoryTier(memory_bytes, memory_ttl_seconds) if memory_bytes > 0 else None
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
         self._client: Redis | None = None
+        self._stats_lock = Lock()
 
     def _get_client(self) -> Redis:
         if self._client is None:
             self._client = Redis.from_url(self.redis_url)
         return self._client
 
-    def _key(self, text: str) -> str:
+    def _key(self, text: str, namespace: str = "") -> str:
+        # The namespace identifies the model that produced the vector, so
+        # switching models never reads another model's vectors.
         digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if namespace:
+            return f"embedding:{namespace}:{digest}"
         return f"embedding:{digest}"
 
-    def get(self, text: str) -> list[float] | None:
-        payload = self._get_client().get(self._key(text))
-        if payload is None:
-            return None
-        return json.loads(payload)
+    def get(self, text: str, namespace: str = "") -> np.ndarray | None:
+        return self.get_many([text], namespace=namespace)[0]
+
+    def set(self, text: str, embedding: np.ndarray, namespace: str = "") -> None:
+        self.set_many({text: embedding}, namespace=namespace)
+
+    def get_many(self, texts: list[str], namespace: str = "") -> list[np.ndarray | None]:
+        if not texts:
+            return []
+        keys = [self._key(text, namespace) for text in texts]
+        vectors: list[np.ndarray | None] = [None] * len(keys)
+        if self.memory is not None:
+            vectors = [self.memory.get(key) for key in keys]
+        remote = [idx for idx, vector in enumerate(vectors) if vector is None]
+        memory_hits = len(keys) - len(remote)
+        redis_hits = 0
+        if remote:
+            # Without Redis the memory tier still answers; only the keys that
+            # had to go to Redis count as misses.
+            try:
+                payloads = self._get_client().mget([keys[idx] for idx in remote])
+            except RedisError:
+                payloads = [None] * len(remote)
+            for idx, payload in zip(remote, payloads):
+                vector = decode_embedding(payload)
+                if vector is None:
+                    continue
+                vectors[idx] = vector
+                redis_hits += 1
+                if self.memory is not None:
+                    self.memory.set(keys[idx], vector)
+        with self._stats_lock:
+            self.memory_hits += memory_hits
+            self.redis_hits += redis_hits
+            self.misses += len(remote) - redis_hits
+        return vectors
+
+    def set_many(self, embeddings: Mapping[str, np.ndarray], namespace: str = "") -> None:
+        if not embeddings:
+            return
+        keys = {text: self._key(text, namespace) for text in embeddings}
+        if self.memory is not None:
+            for text, embedding in embeddings.items():
+                self.memory.set(keys[text], embedding)
+        pipeline = self._get_client().pipeline(transaction=False)
+        for text, embedding in embeddings.items():
+            pipeline.set(keys[text], encode_embedding(embedding, self.dtype))
+        try:
+            pipeline.execute()
+        except RedisError:
+            return
+
+    def stats(self) -> dict[str, float]:
+        with self._stats_lock:
+            lookups = self.memory_hits + self.redis_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "memory_hit_rate": self.memory_hits / lookups if lookups else 0.0,
+                "redis_hit_rate": self.redis_hits / lookups if lookups else 0.0,
+                "memory_bytes": self.memory.size_bytes if self.memory is not None else 0,
+            }
+
+
+@lru_cache
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
+
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float32") -> bytes:
+    code, numpy_dtype = _DTYPES[dtype]
+    return bytes([_FORMAT_VERSION]) + code + np.asarray(embedding, dtype=numpy_dtype).tobytes()
+
 
-    def set(self, text: str, embedding: list[float]) -> None:
-        self._get_client().set(self._key(text), json.dumps(embedding))
+def decode_embedding(payload: bytes | None) -> np.ndarray | None:
+    if payload is None:
+        return None
+    if payload[:1] == b"[":
+        return np.asarray(json.loads(payload), dtype=np.float32)
+    dtype = _DTYPE_BY_CODE.get(payload[1:2])
+    if payload[0] != _FORMAT_VERSION or dtype is None:
+        # Unknown formats are treated as a miss and overwritten.
+        return None
+    return np.frombuffer(payload, dtype=dtype, offset=2).astype(np.float32)
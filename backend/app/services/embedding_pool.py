@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from threading import Lock
+
+import numpy as np
+
+Encoder = Callable[[list[str]], np.ndarray]
+
+_worker_encode: Encoder | None = None
+
+
+class EmbeddingPool:
+    # Spreads bulk embedding over worker processes that each load their own
+    # copy of the model. Callers from several threads (e.g. documents ingested
+    # at the same time) share the same workers.
+    def __init__(
+        self,
+        encoder_factory: Callable[[], Encoder],
+        workers: int,
+        shard_size: int = 256,
+    ) -> None:
+        self.encoder_factory = encoder_factory
+        self.workers = max(workers, 1)
+        self.shard_size = max(shard_size, 1)
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                threads = max((os.cpu_count() or 1) // self.workers, 1)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.encoder_factory, threads),
+                )
+            return self._executor
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # Shards are cut from length-sorted texts so every worker gets chunks
+        # of similar length; rows are put back in the original order.
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        shards = [
+            [texts[idx] for idx in order[start : start + self.shard_size]]
+            for start in range(0, len(texts), self.shard_size)
+        ]
+        encoded = np.vstack(list(self._get_executor().map(_encode_shard, shards)))
+        vectors = np.empty_like(encoded, dtype=np.float32)
+        vectors[order] = encoded
+        return vectors
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def model_encoder(model_name: str, backend: str) -> Encoder:
+    from app.services.embedding_service import EmbeddingService
+
+    return EmbeddingService(model_name, backend=backend)._encode
+
+
+def model_encoder_factory(model_name: str, backend: str) -> Callable[[], Encoder]:
+    return partial(model_encoder, model_name, backend)
+
+
+def _init_worker(encoder_factory: Callable[[], Encoder], threads: int) -> None:
+    global _worker_encode
+    import torch
+
+    # Workers split the cores between them instead of each using all of them.
+    torch.set_num_threads(threads)
+    _worker_encode = encoder_factory()
+
+
+def _encode_shard(texts: list[str]) -> np.ndarray:
+    return np.asarray(_worker_encode(texts), dtype=np.float32)
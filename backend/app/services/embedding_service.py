@@ -1,57 +1,258 @@
+import logging
+import time
+from dataclasses import dataclass
+from threading import Lock
+
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
 from app.core.settings import get_settings
-from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_batcher import QueryBatcher
+from app.services.embedding_cache import EmbeddingCache, get_embedding_cache
+from app.services.embedding_pool import EmbeddingPool, model_encoder_factory
+
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Sentences used to compare a backend's output with the PyTorch reference.
+PARITY_TEXTS = [
+    "The invoice is due within thirty days of delivery.",
+    "Ugovor stupa na snagu danom potpisivanja.",
+    "Revenue grew 12% year over year, driven by the services segment.",
+    "Patient was discharged in stable condition.",
+]
+
+
+@dataclass(frozen=True)
+class BatchTiming:
+    size: int
+    max_tokens: int
+    seconds: float
 
 
 class EmbeddingService:
-    def __init__(self, model_name: str | None = None, cache: EmbeddingCache | None = None) -> None:
+    # Models are loaded once per process and shared by every instance; encode
+    # only runs inference, so concurrent requests can use the same model.
+    _model_by_name: dict[tuple[str, str], SentenceTransformer] = {}
+    _batcher_by_name: dict[tuple[str, str], QueryBatcher] = {}
+    _pool_by_name: dict[tuple[str, str], EmbeddingPool] = {}
+    _model_lock = Lock()
+
+    def __init__(
+        self,
+        model_name: str | None = None,
+        cache: EmbeddingCache | None = None,
+        backend: str | None = None,
+    ) -> None:
         settings = get_settings()
         self.model_name = model_name or settings.embedding_model_name
-        self._model: SentenceTransformer | None = None
-        self._cache = cache or EmbeddingCache()
+        self.backend = backend or settings.embedding_backend
+        if self.backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {self.backend}")
+        self._cache = cache or get_embedding_cache()
+        self.batch_timings: list[BatchTiming] = []
+
+    @property
+    def _registry_key(self) -> tuple[str, str]:
+        return self.model_name, self.backend
+
+    @property
+    def model_id(self) -> str:
+        # Recorded with cached vectors and FAISS indexes built from them.
+        return f"{self.model_name}@{self.backend}"
+
+    def load(self) -> SentenceTransformer:
+        model = self._model_by_name.get(self._registry_key)
+        if model is not None:
+            return model
+        with self._model_lock:
+            if self._registry_key not in self._model_by_name:
+                model = SentenceTransformer(self.model_name, **_backend_kwargs(self.backend))
+                if self.backend != "torch":
+                    self._check_parity(model)
+                self._model_by_name[self._registry_key] = model
+            return self._model_by_name[self._registry_key]
+
+    def warmup(self) -> None:
+        self.load().encode(["warmup"], normalize_embeddings=True)
+
+    def _check_parity(self, model: SentenceTransformer) -> None:
+        # Runs before a non-torch backend joins the registry, so a backend
+        # that deviates from torch is never served. A torch model that is not
+        # loaded already is only created for the check and not kept.
+        min_cosine = get_settings().embedding_parity_min_cosine
+        if min_cosine <= 0:
+            return
+        reference = self._model_by_name.get((self.model_name, "torch")) or SentenceTransformer(self.model_name)
+        cosine = _min_cosine(
+            np.asarray(model.encode(PARITY_TEXTS, normalize_embeddings=True), dtype=np.float32),
+            np.asarray(reference.encode(PARITY_TEXTS, normalize_embeddings=True), dtype=np.float32),
+        )
+        if cosine < min_cosine:
+            raise RuntimeError(
+                f"Embedding backend {self.backend} deviates from torch (cosine {cosine:.4f} < {min_cosine})"
+            )
+
+    @classmethod
+    def evict(cls, model_name: str | None = None, backend: str | None = None) -> None:
+        with cls._model_lock:
+            keys = [
+                key
+                for key in set(cls._model_by_name) | set(cls._batcher_by_name) | set(cls._pool_by_name)
+                if (model_name is None or key[0] == model_name) and (backend is None or key[1] == backend)
+            ]
+            batchers = [cls._batcher_by_name.pop(key) for key in keys if key in cls._batcher_by_name]
+            pools = [cls._pool_by_name.pop(key) for key in keys if key in cls._pool_by_name]
+            for key in keys:
+                cls._model_by_name.pop(key, None)
+        for batcher in batchers:
+            batcher.close()
+        for pool in pools:
+            pool.close()
 
     def _get_model(self) -> SentenceTransformer:
-        if self._model is None:
-            self._model = SentenceTransformer(self.model_name)
-        return self._model
-
-    def embed_texts(self, texts: list[str]) -> list[list[float]]:
-        embeddings: list[list[float]] = []
-        missing: list[str] = []
-        missing_indices: list[int] = []
-
-        for idx, text in enumerate(texts):
-            cached = self._safe_get(text)
-            if cached is None:
-                missing.append(text)
-                missing_indices.append(idx)
-                embeddings.append([])
-            else:
-                embeddings.append(cached)
+        return self.load()
+
+    def embed_texts(self, texts: list[str]) -> np.ndarray:
+        cached = self._safe_get_many(texts)
+        # Duplicate chunks are encoded once.
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
 
+        vectors: dict[str, np.ndarray] = {}
         if missing:
-            model = self._get_model()
-            computed_raw = model.encode(missing, normalize_embeddings=True)
-            computed = computed_raw.tolist() if hasattr(computed_raw, "tolist") else list(computed_raw)
-            for text, vector in zip(missing, computed):
-                self._safe_set(text, vector)
-            for idx, vector in zip(missing_indices, computed):
-                embeddings[idx] = vector
+            vectors = dict(zip(missing, self._encode_bulk(missing)))
+            self._safe_set_many(vectors)
+
+        rows = [vector if vector is not None else vectors[text] for text, vector in zip(texts, cached)]
+        if not rows:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(rows).astype(np.float32, copy=False)
+
+    def embed_many(self, text_lists: list[list[str]]) -> list[np.ndarray]:
+        # Chunks of several documents share one cache lookup and one set of
+        # pool batches.
+        vectors = self.embed_texts([text for texts in text_lists for text in texts])
+        results: list[np.ndarray] = []
+        start = 0
+        for texts in text_lists:
+            results.append(vectors[start : start + len(texts)])
+            start += len(texts)
+        return results
+
+    def embed_query(self, text: str) -> np.ndarray:
+        # Concurrent queries that miss the cache share one forward pass when
+        # EMBEDDING_QUERY_BATCH_WINDOW_MS is set.
+        if get_settings().embedding_query_batch_window_ms <= 0:
+            return self.embed_texts([text])[0]
+        cached = self._safe_get_many([text])[0]
+        if cached is not None:
+            return cached
+        vector = self._get_batcher().embed(text)
+        self._safe_set_many({text: vector})
+        return vector
+
+    def _encode_bulk(self, texts: list[str]) -> np.ndarray:
+        settings = get_settings()
+        if settings.embedding_workers > 1 and len(texts) > settings.embedding_pool_shard_size:
+            return self._get_pool().embed(texts)
+        return self._encode(texts)
 
-        return embeddings
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        # Texts are encoded shortest first in batches of EMBEDDING_BATCH_SIZE so
+        # each batch is padded only to similar lengths, then put back in order.
+        model = self._get_model()
+        batch_size = max(get_settings().embedding_batch_size, 1)
+        lengths = _token_lengths(model, texts)
+        order = np.argsort(lengths, kind="stable")
+        vectors: np.ndarray | None = None
+        timings: list[BatchTiming] = []
+        for start in range(0, len(texts), batch_size):
+            indices = order[start : start + batch_size]
+            started = time.perf_counter()
+            # Without batch_size the model would split the bucket again into
+            # its own default batches of 32.
+            batch = model.encode(
+                [texts[idx] for idx in indices],
+                batch_size=len(indices),
+                normalize_embeddings=True,
+            )
+            batch = np.asarray(batch, dtype=np.float32)
+            timing = BatchTiming(len(indices), int(lengths[indices[-1]]), time.perf_counter() - started)
+            timings.append(timing)
+            logger.debug(
+                "Embedded %d texts of up to %d tokens in %.3fs", timing.size, timing.max_tokens, timing.seconds
+            )
+            if vectors is None:
+                vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[indices] = batch
+        self.batch_timings = timings
+        if vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return vectors
 
-    def embed_query(self, text: str) -> list[float]:
-        return self.embed_texts([text])[0]
+    def _get_pool(self) -> EmbeddingPool:
+        with self._model_lock:
+            pool = self._pool_by_name.get(self._registry_key)
+            if pool is None:
+                settings = get_settings()
+                pool = EmbeddingPool(
+                    model_encoder_factory(self.model_name, self.backend),
+                    workers=settings.embedding_workers,
+                    shard_size=settings.embedding_pool_shard_size,
+                )
+                self._pool_by_name[self._registry_key] = pool
+            return pool
 
-    def _safe_get(self, text: str) -> list[float] | None:
+    def _get_batcher(self) -> QueryBatcher:
+        with self._model_lock:
+            batcher = self._batcher_by_name.get(self._registry_key)
+            if batcher is None:
+                settings = get_settings()
+                batcher = QueryBatcher(
+                    self._encode,
+                    max_batch_size=settings.embedding_query_batch_size,
+                    window_seconds=settings.embedding_query_batch_window_ms / 1000,
+                )
+                self._batcher_by_name[self._registry_key] = batcher
+            return batcher
+
+    def _safe_get_many(self, texts: list[str]) -> list[np.ndarray | None]:
         try:
-            return self._cache.get(text)
+            return self._cache.get_many(texts, namespace=self.model_id)
         except Exception:
-            return None
+            return [None] * len(texts)
 
-    def _safe_set(self, text: str, embedding: list[float]) -> None:
+    def _safe_set_many(self, embeddings: dict[str, np.ndarray]) -> None:
         try:
-            self._cache.set(text, embedding)
+            self._cache.set_many(embeddings, namespace=self.model_id)
         except Exception:
             return
+
+
+def _min_cosine(ours: np.ndarray, theirs: np.ndarray) -> float:
+    norms = np.linalg.norm(ours, axis=1) * np.linalg.norm(theirs, axis=1)
+    return float((np.sum(ours * theirs, axis=1) / np.maximum(norms, 1e-12)).min())
+
+
+def _token_lengths(model: SentenceTransformer, texts: list[str]) -> np.ndarray:
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return np.array([len(text) for text in texts])
+    max_length = getattr(model, "max_seq_length", None) or 512
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    return np.array([len(ids) for ids in encoded["input_ids"]])
+
+
+def _backend_kwargs(backend: str) -> dict:
+    # ONNX backends need the ``sentence-transformers[onnx]`` extra. Without a
+    # file name the plain ONNX model is used (exported on first load if the
+    # model repository does not ship one).
+    settings = get_settings()
+    if backend == "torch":
+        return {}
+    file_name = settings.embedding_onnx_int8_file if backend == "onnx-int8" else settings.embedding_onnx_file
+    if not file_name:
+        return {"backend": "onnx"}
+    return {"backend": "onnx", "model_kwargs": {"file_name": file_name}}
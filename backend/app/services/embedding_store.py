@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+
+from app.core.files import write_atomic
+from app.core.settings import get_settings
+
+
+class EmbeddingStore:
+    # Chunk vectors of a document as a float32 ``.npy`` file, with the chunk ids
+    # and model that produced them, so a FAISS index can be rebuilt without the
+    # embedding model.
+    def __init__(self, store_dir: str | None = None) -> None:
+        settings = get_settings()
+        self.store_dir = Path(store_dir or settings.embedding_store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def _meta_path(self, document_id: int) -> Path:
+        return self.store_dir / f"doc_{document_id}.json"
+
+    def _read_meta(self, document_id: int) -> dict | None:
+        try:
+            return json.loads(self._meta_path(document_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def _vectors_path(self, document_id: int, meta: dict) -> Path:
+        # Stores written before vectors were versioned have no file name in meta.
+        return self.store_dir / meta.get("vectors", f"doc_{document_id}.npy")
+
+    def save(self, document_id: int, vectors: np.ndarray, ids: list[int], model: str) -> None:
+        # Every save writes its vectors to a new file and then atomically
+        # replaces the meta that names it, so readers always get vectors and ids
+        # of the same save. The previous vectors file is removed afterwards.
+        vecs = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vecs) != len(ids):
+            raise ValueError("Embedding count does not match chunk ids")
+        vectors_name = f"doc_{document_id}.{uuid4().hex}.npy"
+        with (self.store_dir / vectors_name).open("wb") as handle:
+            np.save(handle, vecs)
+        previous = self._read_meta(document_id)
+        meta = {
+            "ids": ids,
+            "model": model,
+            "dim": int(vecs.shape[1]) if vecs.ndim == 2 else 0,
+            "vectors": vectors_name,
+        }
+        meta_path = self._meta_path(document_id)
+        write_atomic(meta_path, lambda tmp_path: tmp_path.write_text(json.dumps(meta)))
+        if previous is not None:
+            self._vectors_path(document_id, previous).unlink(missing_ok=True)
+
+    def load(self, document_id: int, model: str) -> tuple[np.ndarray | None, list[int]]:
+        # Vectors are memory-mapped; only the pages FAISS reads are loaded. A
+        # save in between reading meta and its vectors removes them, in which
+        # case the new meta is read again.
+        for _ in range(2):
+            meta = self._read_meta(document_id)
+            if meta is None or meta.get("model") != model:
+                return None, []
+            try:
+                vectors = np.load(self._vectors_path(document_id, meta), mmap_mode="r")
+            except FileNotFoundError:
+                continue
+            if len(vectors) != len(meta["ids"]):
+                return None, []
+            return vectors, meta["ids"]
+        return None, []
+
+    def signature(self, document_id: int) -> tuple[int, ...] | None:
+        # Every save replaces the meta file, so its identity changes with it.
+        try:
+            stat = self._meta_path(document_id).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def matches(self, document_id: int, ids: list[int], model: str) -> bool:
+        meta = self._read_meta(document_id)
+        if meta is None or not self._vectors_path(document_id, meta).exists():
+            return False
+        return meta.get("model") == model and meta.get("ids") == ids
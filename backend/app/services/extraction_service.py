@@ -1,20 +1,100 @@
-from collections.abc import Callable, Iterable
+import hashlib
+import multiprocessing
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING
 
 import fitz
 from sqlalchemy.orm import Session
 
-from app.core.settings import get_settings
+from app.core.settings import Settings, get_settings
 from app.db.models import Document, DocumentChunk, DocumentPage
 from app.db.repos.documents import DocumentRepository
-from app.services.ocr_service import OCRService
+from app.services.chunking_service import ChunkSpan, chunk_texts, chunking_signature, create_chunker
+from app.services.document_service import compute_content_hash
+from app.services.ocr_service import OCRService, pixmap_to_array
 from app.services.language_service import LanguageService
 
+if TYPE_CHECKING:
+    # Imported lazily: extraction workers should not load torch and FAISS.
+    from app.services.embedding_service import EmbeddingService
+    from app.services.embedding_store import EmbeddingStore
+
+# langdetect only looks at the first 10k characters, so that is all we keep
+# around for language detection.
+LANGUAGE_SAMPLE_CHARS = 10_000
+
+# Extraction workers outlive a single document, so each loads its OCR reader
+# once and keeps it, as the serving process does.
+_page_pools: dict[int, ProcessPoolExecutor] = {}
+_page_pool_lock = Lock()
+
+
+@dataclass(frozen=True)
+class PageReadOptions:
+    min_text_length: int
+    ocr_batch_size: int
+    text_salt: str
+    ocr_salt: str
+    ocr_mode: str = "page"
+    region_dpi: int = 200
+    region_min_size: int = 32
+
+    @classmethod
+    def from_settings(cls, settings: Settings, content_hash: str) -> "PageReadOptions":
+        if settings.ocr_mode not in {"page", "regions"}:
+            raise ValueError(f"Unknown OCR mode: {settings.ocr_mode}")
+        ocr_salt = f"ocr={','.join(settings.ocr_languages)}"
+        if settings.ocr_mode == "regions":
+            ocr_salt += f":regions@{settings.ocr_region_dpi}dpi>={settings.ocr_region_min_size}"
+        return cls(
+            min_text_length=settings.ocr_min_text_length,
+            ocr_batch_size=settings.ocr_batch_size,
+            text_salt=f"{content_hash}:chunks={chunking_signature(settings)}",
+            ocr_salt=ocr_salt,
+            ocr_mode=settings.ocr_mode,
+            region_dpi=settings.ocr_region_dpi,
+            region_min_size=settings.ocr_region_min_size,
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        return _sha256(self.text_salt, self.ocr_salt, f"min_text={self.min_text_length}")
+
+    def page_fingerprint(self, text_layer: str, uses_ocr: bool) -> str:
+        # OCR settings only matter for pages that go through OCR, so changing
+        # them leaves text-layer pages untouched.
+        if uses_ocr:
+            return _sha256(self.text_salt, text_layer, self.ocr_salt)
+        return _sha256(self.text_salt, text_layer)
+
+
+@dataclass(frozen=True)
+class _PagePart:
+    # A piece of a page in reading order: native text, or an area to OCR
+    # (``clip`` is None for the whole page).
+    top: float
+    left: float
+    text: str | None = None
+    clip: fitz.Rect | None = None
+
 
 class ExtractionService:
-    def __init__(self, repo: DocumentRepository, ocr_service: OCRService | None = None) -> None:
+    def __init__(
+        self,
+        repo: DocumentRepository,
+        ocr_service: OCRService | None = None,
+        embedding_service: "EmbeddingService | None" = None,
+        embedding_store: "EmbeddingStore | None" = None,
+    ) -> None:
         self.repo = repo
         self._ocr_service = ocr_service
+        self._embedding_service = embedding_service
+        self._embedding_store = embedding_store
 
     def _get_ocr_service(self) -> OCRService:
         if self._ocr_service is None:
@@ -27,96 +107,362 @@ class ExtractionService:
         document: Document,
         progress: Callable[[int, int], None] | None = None,
     ) -> tuple[int, int]:
+        settings = get_settings()
         doc_path = Path(document.file_path)
-        pages: list[DocumentPage] = []
-        chunks: list[DocumentChunk] = []
+        if not document.content_hash:
+            self.repo.update_content_hash(session, document, compute_content_hash(doc_path))
+        # Documents with identical bytes share the pages, chunks and index of
+        # the first document that stored them.
+        requested = document
+        document = self.repo.get_content_document(session, requested)
+        options = PageReadOptions.from_settings(settings, document.content_hash)
+        fingerprint = options.fingerprint
 
+        if document.extraction_checkpoint is None and document.extraction_fingerprint == fingerprint:
+            pages_count = self.repo.count_pages(session, document.id)
+            if pages_count:
+                if settings.extraction_embed_chunks:
+                    self._store_chunk_embeddings(session, document)
+                if progress:
+                    progress(pages_count, pages_count)
+                return pages_count, self.repo.count_chunks(session, document.id)
+
+        # With EXTRACTION_COMMIT_PAGES set, rows are written in batches as pages
+        # arrive and the document records how many pages are persisted, so an
+        # interrupted run picks up from the first missing page. A run started
+        # with other settings is not resumed: extraction starts over and the
+        # page fingerprints skip the pages whose rows are still current.
+        commit_pages = settings.extraction_commit_pages
+        resumable = document.extraction_checkpoint is not None and document.extraction_fingerprint == fingerprint
+        if commit_pages > 0 and resumable:
+            start_page = document.extraction_checkpoint
+        else:
+            start_page = 0
+            if commit_pages > 0:
+                self.repo.begin_extraction(session, document, fingerprint)
+
+        # A chunk that runs across a page break needs the text of its neighbours,
+        # so page-level skipping is only possible when chunks stay on one page.
+        chunker = create_chunker(settings)
+        spans_pages = settings.chunk_strategy == "sentence" and settings.chunk_across_pages
+        known = {} if spans_pages else self.repo.page_fingerprints(session, document.id)
         if document.content_type.startswith("image/"):
-            text = self._get_ocr_service().extract_text_from_image(doc_path)
+            page_texts = self._iter_image_text(doc_path, fingerprint, known, progress, start_page=start_page)
+        else:
+            page_texts = self._iter_page_texts(doc_path, options, known, progress, start_page=start_page)
+
+        pages: list[DocumentPage] = []
+        chunks: list[DocumentChunk] = []
+        pages_count = start_page
+        language_sample = ""
+        for page_index, text, page_fingerprint in page_texts:
+            pages_count += 1
+            if text is None:
+                continue
             pages.append(
                 DocumentPage(
                     document_id=document.id,
-                    page_number=1,
+                    page_number=page_index + 1,
                     text=text,
+                    fingerprint=page_fingerprint,
                 )
             )
-            for chunk_index, (start, end) in enumerate(chunk_ranges(text)):
-                chunks.append(
-                    DocumentChunk(
-                        document_id=document.id,
-                        page_number=1,
-                        chunk_index=chunk_index,
-                        start_offset=start,
-                        end_offset=end,
-                    )
-                )
-            self.repo.replace_pages_and_chunks(session, document.id, pages, chunks)
-            self._update_language_if_missing(session, document, pages)
-            if progress:
-                progress(1, 1)
-            return len(pages), len(chunks)
+            chunks.extend(_chunk_rows(document.id, chunker.add_page(page_index + 1, text)))
+            if len(language_sample) < LANGUAGE_SAMPLE_CHARS:
+                combined = f"{language_sample}\n{text}" if language_sample else text
+                language_sample = combined[:LANGUAGE_SAMPLE_CHARS]
+            if commit_pages > 0 and len(pages) >= commit_pages:
+                # Pages whose text is still held in an open chunk are not
+                # checkpointed, so a resumed run re-reads them.
+                checkpoint = page_index + 1
+                if chunker.pending_page is not None:
+                    checkpoint = min(checkpoint, chunker.pending_page - 1)
+                self.repo.add_extraction_batch(session, document, pages, chunks, checkpoint=checkpoint)
+                pages, chunks = [], []
+
+        chunks.extend(_chunk_rows(document.id, chunker.finish()))
+        self.repo.complete_extraction(
+            session,
+            document,
+            pages,
+            chunks,
+            page_count=pages_count,
+            fingerprint=fingerprint,
+        )
+        if settings.extraction_embed_chunks:
+            self._store_chunk_embeddings(session, document)
+        self._update_language_if_missing(session, requested, language_sample)
+        return pages_count, self.repo.count_chunks(session, document.id)
+
+    def _store_chunk_embeddings(self, session: Session, document: Document) -> None:
+        if self._embedding_service is None:
+            from app.services.embedding_service import EmbeddingService
+
+            self._embedding_service = EmbeddingService()
+        if self._embedding_store is None:
+            from app.services.embedding_store import EmbeddingStore
+
+            self._embedding_store = EmbeddingStore()
+        page_map = {page.page_number: page for page in self.repo.list_pages(session, document.id)}
+        chunks, texts = chunk_texts(self.repo.list_chunks(session, document.id), page_map)
+        chunk_ids = [chunk.id for chunk in chunks]
+        model_id = self._embedding_service.model_id
+        if not texts or self._embedding_store.matches(document.id, chunk_ids, model_id):
+            return
+        vectors = self._embedding_service.embed_texts(texts)
+        self._embedding_store.save(document.id, vectors, chunk_ids, model=model_id)
+
+    def _iter_image_text(
+        self,
+        doc_path: Path,
+        fingerprint: str,
+        known: dict[int, str | None],
+        progress: Callable[[int, int], None] | None = None,
+        start_page: int = 0,
+    ) -> Iterator[tuple[int, str | None, str]]:
+        if start_page > 0:
+            return
+        if known.get(1) == fingerprint:
+            yield 0, None, fingerprint
+        else:
+            yield 0, self._get_ocr_service().extract_text_from_image(doc_path), fingerprint
+        if progress:
+            progress(1, 1)
 
+    def _iter_page_texts(
+        self,
+        doc_path: Path,
+        options: PageReadOptions,
+        known: dict[int, str | None],
+        progress: Callable[[int, int], None] | None = None,
+        start_page: int = 0,
+    ) -> Iterator[tuple[int, str | None, str]]:
+        settings = get_settings()
         with fitz.open(doc_path) as pdf:
-            total_pages = max(pdf.page_count, 1)
-            for page_index in range(pdf.page_count):
-                page = pdf.load_page(page_index)
-                text = page.get_text("text")
-                min_len = get_settings().ocr_min_text_length
-                if not text or len(text.strip()) < min_len:
-                    pix = page.get_pixmap()
-                    image_path = doc_path.parent / f"{doc_path.stem}_page_{page_index + 1}.png"
-                    pix.save(str(image_path))
-                    text = self._get_ocr_service().extract_text_from_image(image_path)
-                    image_path.unlink(missing_ok=True)
-                pages.append(
-                    DocumentPage(
-                        document_id=document.id,
-                        page_number=page_index + 1,
-                        text=text,
-                    )
+            page_count = pdf.page_count
+            batch_size = max(settings.extraction_pages_per_task, 1)
+            if settings.extraction_workers <= 1 or page_count - start_page <= batch_size:
+                total_pages = max(page_count, 1)
+                page_texts = _read_page_texts(
+                    pdf,
+                    range(start_page, page_count),
+                    options,
+                    known,
+                    self._get_ocr_service,
                 )
-                for chunk_index, (start, end) in enumerate(chunk_ranges(text)):
-                    chunks.append(
-                        DocumentChunk(
-                            document_id=document.id,
-                            page_number=page_index + 1,
-                            chunk_index=chunk_index,
-                            start_offset=start,
-                            end_offset=end,
-                        )
-                    )
-                if progress:
-                    progress(page_index + 1, total_pages)
+                for page_index, text, page_fingerprint in page_texts:
+                    yield page_index, text, page_fingerprint
+                    if progress:
+                        progress(page_index + 1, total_pages)
+                return
 
-        self.repo.replace_pages_and_chunks(session, document.id, pages, chunks)
-        self._update_language_if_missing(session, document, pages)
-        return len(pages), len(chunks)
+        yield from _iter_page_texts_parallel(
+            doc_path,
+            page_count,
+            options,
+            known,
+            start_page=start_page,
+            workers=settings.extraction_workers,
+            batch_size=batch_size,
+            progress=progress,
+        )
 
     def _update_language_if_missing(
         self,
         session: Session,
         document: Document,
-        pages: list[DocumentPage],
+        text: str,
     ) -> None:
         if document.language:
             return
-        combined = "\n".join(page.text for page in pages)
-        language = LanguageService().detect_language(combined)
+        language = LanguageService().detect_language(text)
         if language:
             self.repo.update_language(session, document, language)
 
 
-def chunk_ranges(text: str, size: int = 500, overlap: int = 50) -> Iterable[tuple[int, int]]:
-    if size <= 0:
-        return []
-    if overlap >= size:
-        overlap = 0
-    start = 0
-    text_length = len(text)
-    while start < text_length:
-        end = min(start + size, text_length)
-        if end > start:
-            yield start, end
-        if end == text_length:
-            break
-        start = end - overlap
+def _chunk_rows(document_id: int, spans: list[ChunkSpan]) -> list[DocumentChunk]:
+    return [
+        DocumentChunk(
+            document_id=document_id,
+            page_number=span.page_number,
+            chunk_index=span.chunk_index,
+            start_offset=span.start_offset,
+            end_offset=span.end_offset,
+            end_page_number=span.end_page_number,
+        )
+        for span in spans
+    ]
+
+
+def _sha256(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _read_page_texts(
+    pdf: fitz.Document,
+    page_indices: Iterable[int],
+    options: PageReadOptions,
+    known: dict[int, str | None],
+    get_ocr_service: Callable[[], OCRService],
+) -> Iterator[tuple[int, str | None, str]]:
+    # Pages that need OCR are queued and recognized in batches. Pages that come
+    # after a queued one wait with it so pages are still yielded in order, but
+    # never more than a batch of them, so a lone scan does not hold back the
+    # rest of the document. Pages whose fingerprint matches the stored one are
+    # yielded with ``None`` text.
+    pending: list[tuple[int, str | None, str, list[_PagePart] | None]] = []
+    scans: list[fitz.Pixmap] = []
+    batch_size = max(options.ocr_batch_size, 1)
+    for page_index in page_indices:
+        page = pdf.load_page(page_index)
+        text = page.get_text("text")
+        parts = _plan_page_ocr(page, text, options)
+        page_fingerprint = options.page_fingerprint(text, parts is not None)
+        if known.get(page_index + 1) == page_fingerprint:
+            entry = (page_index, None, page_fingerprint, None)
+        elif parts is not None:
+            entry = (page_index, None, page_fingerprint, parts)
+            scans.extend(_render_ocr_parts(page, parts, options))
+        else:
+            entry = (page_index, text, page_fingerprint, None)
+        if not pending and entry[3] is None:
+            yield entry[:3]
+            continue
+        pending.append(entry)
+        if len(scans) >= batch_size or len(pending) > batch_size:
+            yield from _resolve_pending_pages(pending, scans, get_ocr_service())
+            pending, scans = [], []
+    if pending:
+        yield from _resolve_pending_pages(pending, scans, get_ocr_service())
+
+
+def _plan_page_ocr(page: fitz.Page, text: str, options: PageReadOptions) -> list[_PagePart] | None:
+    if options.ocr_mode == "regions":
+        parts = _region_parts(page, options.region_min_size)
+        if parts is not None:
+            return parts
+    if not text or len(text.strip()) < options.min_text_length:
+        return [_PagePart(0.0, 0.0)]
+    return None
+
+
+def _region_parts(page: fitz.Page, min_size: int) -> list[_PagePart] | None:
+    # Native text blocks are kept as they are; only images without a text
+    # layer over them (e.g. an already OCR'd scan) are rendered for OCR.
+    blocks = [block for block in page.get_text("blocks") if block[6] == 0 and block[4].strip()]
+    regions: list[fitz.Rect] = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        if rect.width < min_size or rect.height < min_size or rect in regions:
+            continue
+        covered = any(
+            rect.contains(fitz.Point((block[0] + block[2]) / 2, (block[1] + block[3]) / 2)) for block in blocks
+        )
+        if not covered:
+            regions.append(rect)
+    if not regions:
+        return None
+    parts = [_PagePart(block[1], block[0], text=block[4].strip()) for block in blocks]
+    parts.extend(_PagePart(rect.y0, rect.x0, clip=rect) for rect in regions)
+    return sorted(parts, key=lambda part: (part.top, part.left))
+
+
+def _render_ocr_parts(page: fitz.Page, parts: list[_PagePart], options: PageReadOptions) -> list[fitz.Pixmap]:
+    return [
+        page.get_pixmap(alpha=False)
+        if part.clip is None
+        else page.get_pixmap(dpi=options.region_dpi, clip=part.clip, alpha=False)
+        for part in parts
+        if part.text is None
+    ]
+
+
+def _resolve_pending_pages(
+    pending: list[tuple[int, str | None, str, list[_PagePart] | None]],
+    scans: list[fitz.Pixmap],
+    ocr_service: OCRService,
+) -> Iterator[tuple[int, str | None, str]]:
+    ocr_texts = iter(ocr_service.extract_text_from_arrays([pixmap_to_array(pix) for pix in scans]))
+    for page_index, text, page_fingerprint, parts in pending:
+        if parts is not None:
+            texts = [part.text if part.text is not None else next(ocr_texts) for part in parts]
+            text = texts[0] if len(texts) == 1 else "\n".join(part for part in texts if part.strip())
+        yield page_index, text, page_fingerprint
+
+
+def _iter_page_texts_parallel(
+    doc_path: Path,
+    page_count: int,
+    options: PageReadOptions,
+    known: dict[int, str | None],
+    *,
+    start_page: int,
+    workers: int,
+    batch_size: int,
+    progress: Callable[[int, int], None] | None = None,
+) -> Iterator[tuple[int, str | None, str]]:
+    # Workers finish out of order; results are buffered until the next page in
+    # sequence is available so callers still see pages in document order. At
+    # most 2 * workers batches past the next page are submitted at a time, so
+    # a slow batch does not let finished ones pile up in memory.
+    total_pages = max(page_count, 1)
+    window = 2 * workers * batch_size
+    buffered: dict[int, tuple[str | None, str]] = {}
+    next_page = start_page
+    submitted = start_page
+    done = start_page
+    executor = _get_page_pool(workers)
+    futures: set[Future] = set()
+    try:
+        while next_page < page_count:
+            while submitted < min(next_page + window, page_count):
+                batch = list(range(submitted, min(submitted + batch_size, page_count)))
+                known_batch = {page_index + 1: known.get(page_index + 1) for page_index in batch}
+                futures.add(executor.submit(_extract_page_batch, str(doc_path), batch, options, known_batch))
+                submitted = batch[-1] + 1
+            finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results = future.result()
+                for page_index, text, page_fingerprint in results:
+                    buffered[page_index] = (text, page_fingerprint)
+                done += len(results)
+                if progress:
+                    progress(done, total_pages)
+            while next_page in buffered:
+                yield next_page, *buffered.pop(next_page)
+                next_page += 1
+    except BrokenProcessPool:
+        _discard_page_pool(workers, executor)
+        raise
+    finally:
+        # Batches of an abandoned extraction are not left to run.
+        for future in futures:
+            future.cancel()
+
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    with _page_pool_lock:
+        executor = _page_pools.get(workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _page_pools[workers] = executor
+        return executor
+
+
+def _discard_page_pool(workers: int, executor: ProcessPoolExecutor) -> None:
+    # A worker that died (e.g. killed for memory) breaks the pool; the next
+    # extraction starts a new one.
+    with _page_pool_lock:
+        if _page_pools.get(workers) is executor:
+            del _page_pools[workers]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_page_batch(
+    file_path: str,
+    page_indices: list[int],
+    options: PageReadOptions,
+    known: dict[int, str | None],
+) -> list[tuple[int, str | None, str]]:
+    with fitz.open(file_path) as pdf:
+        return list(_read_page_texts(pdf, page_indices, options, known, OCRService))
@@ -1,17 +1,242 @@
 import json
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from threading import Lock
 
 import faiss
 import numpy as np
 
+from app.core.files import write_atomic
 from app.core.settings import get_settings
+from app.services.embedding_store import EmbeddingStore
+
+
+class IndexCache:
+    # Loaded indexes and their metadata by index path, bounded by the indexes'
+    # size on disk. Entries remember the files' modification times, so an index
+    # rewritten by any process is read again. Stored vectors used to re-rank
+    # compressed indexes are kept the same way, with their rows by chunk id.
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[tuple[int, ...], faiss.Index | np.ndarray, dict, int]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str, signature: tuple[int, ...]) -> tuple[faiss.Index | np.ndarray, dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(
+        self,
+        key: str,
+        signature: tuple[int, ...],
+        index: faiss.Index | np.ndarray,
+        meta: dict,
+        size: int,
+    ) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, index, meta, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size_bytes -= entry[3]
+
+
+# IO_FLAG_MMAP_IFC maps flat vector storage straight from the file (FAISS
+# 1.11+); older releases fall back to IO_FLAG_MMAP, which maps IVF lists.
+MMAP_READ_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+@lru_cache
+def get_index_cache() -> IndexCache:
+    return IndexCache(get_settings().faiss_cache_bytes)
+
+
+FAISS_INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+
+def index_kind(count: int, removable: bool = False) -> str:
+    settings = get_settings()
+    kind = settings.faiss_index_type
+    if kind == "auto":
+        if count >= settings.faiss_ivf_threshold:
+            kind = "ivf"
+        elif count >= settings.faiss_hnsw_threshold:
+            kind = "hnsw"
+        else:
+            kind = "flat"
+    if kind not in FAISS_INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type: {kind}")
+    # HNSW graphs cannot drop vectors, so indexes that need removal use IVF.
+    if kind == "hnsw" and removable:
+        return "ivf"
+    return kind
+
+
+FAISS_COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+SCALAR_QUANTIZERS = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+# 8-bit PQ codebooks have 256 centroids per sub-quantizer and need at least as
+# many training vectors; smaller indexes fall back to SQ8.
+PQ_MIN_VECTORS = 256
+
+
+def build_index(vectors: np.ndarray, removable: bool = False, compression: str | None = None) -> faiss.Index:
+    # Returns an empty index of the kind chosen for ``vectors``, trained on
+    # them where the kind needs training. Removable indexes take explicit ids.
+    settings = get_settings()
+    count, dim = vectors.shape
+    kind = index_kind(count, removable)
+    compression = compression or settings.faiss_compression
+    if compression not in FAISS_COMPRESSIONS:
+        raise ValueError(f"Unknown FAISS compression: {compression}")
+    if compression == "pq" and count < PQ_MIN_VECTORS:
+        compression = "sq8"
+    metric = faiss.METRIC_INNER_PRODUCT
+    if kind == "hnsw":
+        if compression == "pq":
+            index = faiss.IndexHNSWPQ(dim, _pq_subquantizers(dim), settings.faiss_hnsw_m, 8, metric)
+        elif compression in SCALAR_QUANTIZERS:
+            index = faiss.IndexHNSWSQ(dim, SCALAR_QUANTIZERS[compression], settings.faiss_hnsw_m, metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, settings.faiss_hnsw_m, metric)
+        index.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+    elif kind == "ivf":
+        nlist = settings.faiss_ivf_nlist or int(4 * math.sqrt(count))
+        # k-means wants a few dozen training points per list.
+        nlist = max(1, min(nlist, count // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        if compression == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), 8, metric)
+        elif compression in SCALAR_QUANTIZERS:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, SCALAR_QUANTIZERS[compression], metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    elif compression == "pq":
+        index = faiss.IndexPQ(dim, _pq_subquantizers(dim), 8, metric)
+    elif compression in SCALAR_QUANTIZERS:
+        index = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[compression], metric)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    if not index.is_trained:
+        index.train(vectors)
+    if removable and kind == "flat":
+        return faiss.IndexIDMap2(index)
+    return index
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # The largest divisor of the dimension not above FAISS_PQ_M.
+    wanted = max(1, min(get_settings().faiss_pq_m, dim))
+    return next(m for m in range(wanted, 0, -1) if dim % m == 0)
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector | None = None) -> faiss.SearchParameters | None:
+    settings = get_settings()
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=settings.faiss_hnsw_ef_search, sel=selector)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=settings.faiss_ivf_nprobe, sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+@dataclass(frozen=True)
+class CompressionReport:
+    compression: str
+    index: str
+    bytes: int
+    bytes_per_vector: float
+    recall: float
+    reranked_recall: float
+
+
+def compression_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    top_k: int = 5,
+    rerank_factor: int | None = None,
+) -> list[CompressionReport]:
+    # Index size and recall@top_k against exact search, with and without
+    # re-ranking, for every compression on the given vectors. Index kinds
+    # follow the current settings.
+    vecs = np.ascontiguousarray(vectors, dtype="float32")
+    qs = np.ascontiguousarray(queries, dtype="float32").reshape(-1, vecs.shape[1])
+    k = min(top_k, len(vecs))
+    factor = max(rerank_factor or get_settings().faiss_rerank_factor, 1)
+    exact = faiss.IndexFlatIP(vecs.shape[1])
+    exact.add(vecs)
+    _, truth = exact.search(qs, k)
+    reports: list[CompressionReport] = []
+    for compression in FAISS_COMPRESSIONS:
+        index = build_index(vecs, compression=compression)
+        index.add(vecs)
+        size = len(faiss.serialize_index(index))
+        params = search_parameters(index)
+        _, found = index.search(qs, k, params=params)
+        _, shortlist = index.search(qs, k * factor, params=params)
+        reranked = []
+        for query, candidates in zip(qs, shortlist):
+            candidates = candidates[candidates >= 0]
+            reranked.append(candidates[np.argsort(-(vecs[candidates] @ query))[:k]])
+        reports.append(
+            CompressionReport(
+                compression=compression,
+                index=_index_type(index),
+                bytes=size,
+                bytes_per_vector=size / len(vecs),
+                recall=_recall(found, truth),
+                reranked_recall=_recall(reranked, truth),
+            )
+        )
+    return reports
+
+
+def _recall(found, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(row) & set(expected)) / len(expected) for row, expected in zip(found, truth)]))
 
 
 class FaissService:
-    def __init__(self, index_dir: str | None = None) -> None:
+    def __init__(
+        self,
+        index_dir: str | None = None,
+        cache: IndexCache | None = None,
+        mmap: bool | None = None,
+        embedding_store: EmbeddingStore | None = None,
+    ) -> None:
+        # With ``embedding_store``, results from compressed indexes are
+        # re-scored against the stored float32 chunk vectors.
         settings = get_settings()
         self.index_dir = Path(index_dir or settings.faiss_index_dir)
         self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._cache = cache or get_index_cache()
+        self.mmap = settings.faiss_mmap if mmap is None else mmap
+        self.embedding_store = embedding_store
 
     def _index_path(self, document_id: int) -> Path:
         return self.index_dir / f"doc_{document_id}.index"
@@ -19,34 +244,297 @@ class FaissService:
     def _meta_path(self, document_id: int) -> Path:
         return self.index_dir / f"doc_{document_id}.json"
 
-    def save_index(self, document_id: int, vectors: list[list[float]], ids: list[int]) -> None:
-        if not vectors:
+    def save_index(
+        self,
+        document_id: int,
+        vectors: np.ndarray,
+        ids: list[int],
+        model: str | None = None,
+    ) -> None:
+        if len(vectors) == 0:
             return
-        dim = len(vectors[0])
-        index = faiss.IndexFlatIP(dim)
-        vecs = np.array(vectors, dtype="float32")
+        vecs = np.asarray(vectors, dtype="float32")
+        index = build_index(vecs)
         index.add(vecs)
-        faiss.write_index(index, str(self._index_path(document_id)))
-        self._meta_path(document_id).write_text(json.dumps(ids))
+        index_path = self._index_path(document_id)
+        self._cache.invalidate(str(index_path))
+        # Replacing the file (rather than rewriting it) keeps indexes that other
+        # processes have memory-mapped intact.
+        write_atomic(index_path, lambda tmp_path: faiss.write_index(index, str(tmp_path)))
+        meta = {
+            "ids": ids,
+            "model": model,
+            "dim": int(vecs.shape[1]),
+            "index": _index_type(index),
+            "compression": get_settings().faiss_compression,
+        }
+        write_atomic(self._meta_path(document_id), lambda tmp_path: tmp_path.write_text(json.dumps(meta)))
+
+    def load_index(self, document_id: int, model: str | None = None, dim: int | None = None):
+        # An index built by another embedding model (or with another dimension
+        # or compression) is reported as missing so the caller rebuilds it.
+        # Metadata written before the model was recorded is a bare list of ids
+        # and is only checked by dimension.
+        loaded = self._read_index(document_id)
+        if loaded is None:
+            return None, []
+        index, meta = loaded
+        if model is not None and meta["model"] is not None and meta["model"] != model:
+            return None, []
+        if dim is not None and index.d != dim:
+            return None, []
+        if meta.get("compression", "none") != get_settings().faiss_compression:
+            return None, []
+        return index, meta["ids"]
 
-    def load_index(self, document_id: int):
+    def _read_index(self, document_id: int) -> tuple[faiss.Index, dict] | None:
         index_path = self._index_path(document_id)
         meta_path = self._meta_path(document_id)
-        if not index_path.exists() or not meta_path.exists():
-            return None, []
-        index = faiss.read_index(str(index_path))
-        ids = json.loads(meta_path.read_text())
-        return index, ids
+        try:
+            index_stat, meta_stat = index_path.stat(), meta_path.stat()
+        except FileNotFoundError:
+            return None
+        signature = (index_stat.st_mtime_ns, index_stat.st_size, meta_stat.st_mtime_ns, meta_stat.st_size)
+        cached = self._cache.get(str(index_path), signature)
+        if cached is not None:
+            return cached
+        meta = json.loads(meta_path.read_text())
+        if isinstance(meta, list):
+            meta = {"ids": meta, "model": None}
+        index, size = self._read_file(index_path, index_stat.st_size, meta_stat.st_size)
+        self._cache.put(str(index_path), signature, index, meta, size)
+        return index, meta
+
+    def _read_file(self, index_path: Path, index_size: int, meta_size: int) -> tuple[faiss.Index, int]:
+        # Returns the index and the size it counts against the cache budget.
+        if self.mmap:
+            # Mapped pages live in the OS page cache and are shared between
+            # worker processes; only the metadata counts against the budget.
+            return faiss.read_index(str(index_path), MMAP_READ_FLAGS), meta_size
+        return faiss.read_index(str(index_path)), index_size
 
-    def search(self, document_id: int, query_vector: list[float], top_k: int) -> list[tuple[int, float]]:
-        index, ids = self.load_index(document_id)
-        if index is None or not ids:
+    def search(self, document_id: int, query_vector: np.ndarray, top_k: int) -> list[tuple[int, float]]:
+        loaded = self._read_index(document_id)
+        if loaded is None or not loaded[1]["ids"]:
             return []
-        vec = np.array([query_vector], dtype="float32")
-        scores, indices = index.search(vec, top_k)
-        results: list[tuple[int, float]] = []
+        index, meta = loaded
+        ids = meta["ids"]
+        vec = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+        rerank = self._reranks(meta)
+        shortlist = top_k * get_settings().faiss_rerank_factor if rerank else top_k
+        scores, indices = index.search(vec, shortlist, params=search_parameters(index))
+        results: list[tuple[int, int, float]] = []
         for idx, score in zip(indices[0], scores[0]):
             if idx < 0 or idx >= len(ids):
                 continue
-            results.append((ids[idx], float(score)))
-        return results
+            results.append((document_id, ids[idx], float(score)))
+        if rerank:
+            results = self._rerank(vec[0], results, meta["model"])
+        return [(chunk_id, score) for _, chunk_id, score in results[:top_k]]
+
+    def _reranks(self, meta: dict) -> bool:
+        return (
+            self.embedding_store is not None
+            and meta.get("compression", "none") != "none"
+            and meta.get("model") is not None
+            and get_settings().faiss_rerank_factor > 0
+        )
+
+    def _rerank(
+        self,
+        query: np.ndarray,
+        results: list[tuple[int, int, float]],
+        model: str,
+    ) -> list[tuple[int, int, float]]:
+        # Re-scores (document id, chunk id, score) results with the exact
+        # vectors in the embedding store. Results are left as they are unless
+        # every one of them has a stored vector.
+        exact: list[tuple[int, int, float]] = []
+        stored: dict[int, tuple[np.ndarray, dict[int, int]]] = {}
+        for document_id, chunk_id, _ in results:
+            if document_id not in stored:
+                loaded = self._stored_vectors(document_id, model)
+                if loaded is None:
+                    return results
+                stored[document_id] = loaded
+            vectors, rows = stored[document_id]
+            row = rows.get(chunk_id)
+            if row is None:
+                return results
+            exact.append((document_id, chunk_id, float(np.dot(vectors[row], query))))
+        return sorted(exact, key=lambda result: result[2], reverse=True)
+
+    def _stored_vectors(self, document_id: int, model: str) -> tuple[np.ndarray, dict[int, int]] | None:
+        # The memory-mapped vectors and their rows by chunk id stay in the index
+        # cache until the document's vectors are saved again.
+        signature = self.embedding_store.signature(document_id)
+        if signature is None:
+            return None
+        key = f"{self.embedding_store.store_dir / f'doc_{document_id}'}@{model}"
+        cached = self._cache.get(key, signature)
+        if cached is not None:
+            return cached
+        vectors, ids = self.embedding_store.load(document_id, model=model)
+        if vectors is None:
+            return None
+        rows = {stored_id: row for row, stored_id in enumerate(ids)}
+        # Mapped pages live in the OS page cache; the row map is what stays in
+        # process memory.
+        self._cache.put(key, signature, vectors, rows, signature[-1])
+        return vectors, rows
+
+    def _library_path(self, user_id: int) -> Path:
+        return self.index_dir / f"user_{user_id}.index"
+
+    def _library_meta_path(self, user_id: int) -> Path:
+        return self.index_dir / f"user_{user_id}.json"
+
+    def load_library(
+        self,
+        user_id: int,
+        model: str | None = None,
+        dim: int | None = None,
+    ) -> tuple[faiss.Index | None, dict[int, list[int]]]:
+        # A user's library index holds the chunks of all their documents in one
+        # index keyed by chunk id (an IndexIDMap2 over flat or compressed
+        # storage, or IVF once the library is large); the metadata lists the chunk ids of
+        # every (content) document in it.
+        loaded = self._read_library(user_id)
+        if loaded is None:
+            return None, {}
+        index, meta = loaded
+        if model is not None and meta["model"] != model:
+            return None, {}
+        if dim is not None and index.d != dim:
+            return None, {}
+        if meta["compression"] != get_settings().faiss_compression:
+            return None, {}
+        return index, meta["documents"]
+
+    def _read_library(self, user_id: int) -> tuple[faiss.Index, dict] | None:
+        index_path = self._library_path(user_id)
+        meta_path = self._library_meta_path(user_id)
+        try:
+            index_stat, meta_stat = index_path.stat(), meta_path.stat()
+        except FileNotFoundError:
+            return None
+        signature = (index_stat.st_mtime_ns, index_stat.st_size, meta_stat.st_mtime_ns, meta_stat.st_size)
+        cached = self._cache.get(str(index_path), signature)
+        if cached is not None:
+            return cached
+        raw = json.loads(meta_path.read_text())
+        documents = {int(document_id): ids for document_id, ids in raw["documents"].items()}
+        meta = {
+            "model": raw["model"],
+            "compression": raw.get("compression", "none"),
+            "documents": documents,
+            "chunk_documents": {chunk_id: doc_id for doc_id, ids in documents.items() for chunk_id in ids},
+        }
+        index, size = self._read_file(index_path, index_stat.st_size, meta_stat.st_size)
+        self._cache.put(str(index_path), signature, index, meta, size)
+        return index, meta
+
+    def update_library(
+        self,
+        user_id: int,
+        add: dict[int, tuple[np.ndarray, list[int]]],
+        remove: list[int],
+        model: str,
+        reset: bool = False,
+    ) -> None:
+        # Documents in ``add`` replace whatever the index held for them.
+        index_path = self._library_path(user_id)
+        meta_path = self._library_meta_path(user_id)
+        index: faiss.Index | None = None
+        documents: dict[int, list[int]] = {}
+        if not reset and index_path.exists() and meta_path.exists():
+            # Read a private copy; the cached one may be in use by searches.
+            index = faiss.read_index(str(index_path))
+            raw = json.loads(meta_path.read_text())
+            documents = {int(document_id): ids for document_id, ids in raw["documents"].items()}
+        if index is None:
+            if not add:
+                return
+            # The new index is trained on (and compressed for) the vectors added.
+            added = np.concatenate([np.asarray(vectors, dtype="float32") for vectors, _ in add.values()])
+            index = build_index(added, removable=True)
+
+        stale = [chunk_id for document_id in [*remove, *add] for chunk_id in documents.pop(document_id, [])]
+        if stale:
+            index.remove_ids(np.array(stale, dtype="int64"))
+        for document_id, (vectors, ids) in add.items():
+            if len(ids) == 0:
+                continue
+            index.add_with_ids(np.asarray(vectors, dtype="float32"), np.array(ids, dtype="int64"))
+            documents[document_id] = sorted(ids)
+        index = _grow_library(index)
+
+        self._cache.invalidate(str(index_path))
+        write_atomic(index_path, lambda tmp_path: faiss.write_index(index, str(tmp_path)))
+        meta = {
+            "model": model,
+            "dim": int(index.d),
+            "index": _index_type(index),
+            "compression": get_settings().faiss_compression,
+            "documents": documents,
+        }
+        write_atomic(meta_path, lambda tmp_path: tmp_path.write_text(json.dumps(meta)))
+
+    def search_library(
+        self,
+        user_id: int,
+        query_vector: np.ndarray,
+        top_k: int,
+        document_ids: list[int] | None = None,
+        model: str | None = None,
+    ) -> list[tuple[int, int, float]]:
+        # Returns (document id, chunk id, score). ``document_ids`` limits the
+        # search to those documents' chunks.
+        loaded = self._read_library(user_id)
+        if loaded is None or loaded[0].ntotal == 0:
+            return []
+        index, meta = loaded
+        if model is not None and meta["model"] != model:
+            return []
+        documents, chunk_documents = meta["documents"], meta["chunk_documents"]
+        # The selector has to stay referenced until the search has run.
+        selector = None
+        if document_ids is not None:
+            allowed = [chunk_id for document_id in document_ids for chunk_id in documents.get(document_id, [])]
+            if not allowed:
+                return []
+            selector = faiss.IDSelectorBatch(np.array(allowed, dtype="int64"))
+        params = search_parameters(index, selector)
+        vec = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+        rerank = self._reranks(meta)
+        shortlist = top_k * get_settings().faiss_rerank_factor if rerank else top_k
+        scores, labels = index.search(vec, shortlist, params=params)
+        results: list[tuple[int, int, float]] = []
+        for chunk_id, score in zip(labels[0], scores[0]):
+            document_id = chunk_documents.get(int(chunk_id))
+            if document_id is None:
+                continue
+            results.append((document_id, int(chunk_id), float(score)))
+        if rerank:
+            results = self._rerank(vec[0], results, meta["model"])
+        return results[:top_k]
+
+
+def _grow_library(index: faiss.Index) -> faiss.Index:
+    # A flat library that has grown past the IVF threshold is rebuilt as IVF,
+    # trained on everything it holds. IVF libraries are never shrunk back.
+    if index.ntotal == 0 or _index_type(index) == "ivf" or index_kind(index.ntotal, removable=True) != "ivf":
+        return index
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    ids = faiss.vector_to_array(index.id_map)
+    grown = build_index(vectors, removable=True)
+    grown.add_with_ids(vectors, ids)
+    return grown
+
+
+def _index_type(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
@@ -0,0 +1,86 @@
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+from redis import Redis
+
+from app.core.files import write_atomic
+from app.core.settings import get_settings
+
+
+class OCRCache:
+    def __init__(
+        self,
+        backend: str | None = None,
+        redis_url: str | None = None,
+        cache_dir: str | None = None,
+    ) -> None:
+        settings = get_settings()
+        self.backend = backend or settings.ocr_cache_backend
+        if self.backend not in {"redis", "disk", "none"}:
+            raise ValueError(f"Unknown OCR cache backend: {self.backend}")
+        self.redis_url = redis_url or settings.redis_url
+        self.cache_dir = Path(cache_dir or settings.ocr_cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self._client: Redis | None = None
+        self._stats_lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend != "none"
+
+    def _get_client(self) -> Redis:
+        if self._client is None:
+            self._client = Redis.from_url(self.redis_url)
+        return self._client
+
+    def key_for_array(self, image: np.ndarray, languages: tuple[str, ...]) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{','.join(languages)}|{image.shape}|{image.dtype}|".encode("utf-8"))
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def key_for_bytes(self, content: bytes, languages: tuple[str, ...]) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{','.join(languages)}|file|".encode("utf-8"))
+        digest.update(content)
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> str | None:
+        if self.backend == "redis":
+            payload = self._get_client().get(f"ocr:{key}")
+            return payload.decode("utf-8") if payload is not None else None
+        if self.backend == "disk":
+            path = self._disk_path(key)
+            return path.read_text(encoding="utf-8") if path.exists() else None
+        return None
+
+    def set(self, key: str, text: str) -> None:
+        if self.backend == "redis":
+            self._get_client().set(f"ocr:{key}", text.encode("utf-8"))
+        elif self.backend == "disk":
+            path = self._disk_path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(path, lambda tmp_path: tmp_path.write_text(text, encoding="utf-8"))
+
+    def record(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+@lru_cache
+def get_ocr_cache() -> OCRCache:
+    return OCRCache()
@@ -1,15 +1,114 @@
+import logging
 from pathlib import Path
+from threading import Lock
 
 import easyocr
+import numpy as np
 
 from app.core.settings import get_settings
+from app.services.ocr_cache import OCRCache, get_ocr_cache
+
+logger = logging.getLogger(__name__)
 
 
 class OCRService:
-    def __init__(self) -> None:
+    _reader_by_languages: dict[tuple[str, ...], easyocr.Reader] = {}
+    _reader_lock = Lock()
+
+    def __init__(self, languages: list[str] | None = None, cache: OCRCache | None = None) -> None:
         settings = get_settings()
-        self.reader = easyocr.Reader(settings.ocr_languages, gpu=False)
+        self.languages = tuple(languages or settings.ocr_languages)
+        self._cache = cache or get_ocr_cache()
+
+    @property
+    def reader(self) -> easyocr.Reader:
+        self.load()
+        return self._reader_by_languages[self.languages]
+
+    def load(self) -> None:
+        if self.languages in self._reader_by_languages:
+            return
+        with self._reader_lock:
+            if self.languages not in self._reader_by_languages:
+                self._reader_by_languages[self.languages] = easyocr.Reader(list(self.languages), gpu=False)
 
     def extract_text_from_image(self, image_path: Path) -> str:
+        key = self._cache.key_for_bytes(image_path.read_bytes(), self.languages) if self._cache.enabled else None
+        cached = self._safe_get(key)
+        if cached is not None:
+            return cached
         results = self.reader.readtext(str(image_path))
-        return " ".join(result[1] for result in results)
+        text = " ".join(result[1] for result in results)
+        self._safe_set(key, text)
+        return text
+
+    def extract_text_from_array(self, image: np.ndarray) -> str:
+        return self.extract_text_from_arrays([image])[0]
+
+    def extract_text_from_arrays(self, images: list[np.ndarray]) -> list[str]:
+        if self._cache.enabled:
+            keys = [self._cache.key_for_array(image, self.languages) for image in images]
+        else:
+            keys = [None] * len(images)
+        texts = [self._safe_get(key) for key in keys]
+        missing = [idx for idx, text in enumerate(texts) if text is None]
+        if missing:
+            recognized = self._recognize_arrays([images[idx] for idx in missing])
+            for idx, text in zip(missing, recognized):
+                texts[idx] = text
+                self._safe_set(keys[idx], text)
+        if self._cache.enabled:
+            stats = self._cache.stats()
+            logger.info(
+                "OCR cache served %d of %d pages (process totals: %d hits, %d misses)",
+                len(images) - len(missing),
+                len(images),
+                stats["hits"],
+                stats["misses"],
+            )
+        return texts
+
+    def _recognize_arrays(self, images: list[np.ndarray]) -> list[str]:
+        # readtext_batched needs equally sized inputs, so pages are grouped by
+        # shape; a typical PDF renders every page at the same size.
+        texts = [""] * len(images)
+        groups: dict[tuple[int, ...], list[int]] = {}
+        for idx, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(idx)
+        batch_size = max(get_settings().ocr_batch_size, 1)
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start : start + batch_size]
+                if len(batch) == 1:
+                    results = self.reader.readtext(images[batch[0]])
+                    texts[batch[0]] = " ".join(result[1] for result in results)
+                    continue
+                batched = self.reader.readtext_batched([images[idx] for idx in batch])
+                for idx, results in zip(batch, batched):
+                    texts[idx] = " ".join(result[1] for result in results)
+        return texts
+
+    def _safe_get(self, key: str | None) -> str | None:
+        if key is None:
+            return None
+        try:
+            cached = self._cache.get(key)
+        except Exception:
+            cached = None
+        self._cache.record(cached is not None)
+        return cached
+
+    def _safe_set(self, key: str | None, text: str) -> None:
+        if key is None:
+            return
+        try:
+            self._cache.set(key, text)
+        except Exception:
+            return
+
+
+def pixmap_to_array(pix) -> np.ndarray:
+    image = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        return image[:, :, 0]
+    return image
@@ -1,10 +1,13 @@
 from dataclasses import dataclass
 
+import numpy as np
 from sqlalchemy.orm import Session
 
-from app.db.models import DocumentChunk, DocumentPage
+from app.db.models import Document, DocumentPage
 from app.db.repos.documents import DocumentRepository
+from app.services.chunking_service import chunk_text, chunk_texts
 from app.services.embedding_service import EmbeddingService
+from app.services.embedding_store import EmbeddingStore
 from app.services.faiss_service import FaissService
 
 
@@ -23,10 +26,12 @@ class RetrievalService:
         repo: DocumentRepository,
         embedding_service: EmbeddingService | None = None,
         faiss_service: FaissService | None = None,
+        embedding_store: EmbeddingStore | None = None,
     ) -> None:
         self.repo = repo
         self.embedding_service = embedding_service or EmbeddingService()
-        self.faiss_service = faiss_service or FaissService()
+        self.embedding_store = embedding_store or EmbeddingStore()
+        self.faiss_service = faiss_service or FaissService(embedding_store=self.embedding_store)
 
     def retrieve(
         self,
@@ -39,42 +44,36 @@ class RetrievalService:
     ) -> list[RetrievalResult]:
         if not query.strip():
             return []
-        pages = self.repo.list_pages(session, document_id)
-        chunks = self.repo.list_chunks(session, document_id)
+        document = session.get(Document, document_id)
+        content_id = document.content_document_id if document else document_id
+        pages = self.repo.list_pages(session, content_id)
+        chunks = self.repo.list_chunks(session, content_id)
         if not pages or not chunks:
             return []
 
         page_map = {page.page_number: page for page in pages}
-        texts: list[str] = []
-        chunk_meta: list[DocumentChunk] = []
-        for chunk in chunks:
-            page = page_map.get(chunk.page_number)
-            if not page:
-                continue
-            snippet = page.text[chunk.start_offset:chunk.end_offset]
-            texts.append(snippet)
-            chunk_meta.append(chunk)
-
+        chunk_meta, texts = chunk_texts(chunks, page_map)
         if not texts:
             return []
 
         chunk_by_id = {chunk.id: chunk for chunk in chunk_meta}
-        index, ids = self.faiss_service.load_index(document_id)
-        if index is None or len(ids) != len(texts):
-            vectors = self.embedding_service.embed_texts(texts)
-            ids = [chunk.id for chunk in chunk_meta]
-            self.faiss_service.save_index(document_id, vectors, ids)
-
+        chunk_ids = [chunk.id for chunk in chunk_meta]
+        model_id = self.embedding_service.model_id
         query_vector = self.embedding_service.embed_query(query)
-        scored = self.faiss_service.search(document_id, query_vector, top_k + offset)
+        dim = np.asarray(query_vector).shape[-1]
+        index, ids = self.faiss_service.load_index(content_id, model=model_id, dim=dim)
+        if index is None or ids != chunk_ids:
+            vectors = self._chunk_vectors(content_id, texts, chunk_ids, model_id)
+            self.faiss_service.save_index(content_id, vectors, chunk_ids, model=model_id)
+
+        scored = self.faiss_service.search(content_id, query_vector, top_k + offset)
 
         results: list[RetrievalResult] = []
         for chunk_id, score in scored[offset : offset + top_k]:
             chunk = chunk_by_id.get(chunk_id)
             if chunk is None:
                 continue
-            page = page_map[chunk.page_number]
-            snippet = page.text[chunk.start_offset:chunk.end_offset]
+            snippet = chunk_text(chunk, page_map) or ""
             if score < min_score:
                 continue
             results.append(
@@ -87,3 +86,114 @@ class RetrievalService:
                 )
             )
         return results
+
+    def retrieve_library(
+        self,
+        session: Session,
+        user_id: int,
+        query: str,
+        top_k: int = 3,
+        min_score: float = 0.0,
+        document_ids: list[int] | None = None,
+    ) -> list[RetrievalResult]:
+        # Searches all of a user's documents (or the given subset) through one
+        # library index, which is brought up to date with their chunks first.
+        if not query.strip():
+            return []
+        all_documents = self.repo.list_for_user(session, user_id)
+        documents = all_documents
+        if document_ids is not None:
+            wanted = set(document_ids)
+            documents = [document for document in all_documents if document.id in wanted]
+        document_by_content: dict[int, int] = {}
+        for document in documents:
+            document_by_content.setdefault(document.content_document_id, document.id)
+
+        model_id = self.embedding_service.model_id
+        query_vector = self.embedding_service.embed_query(query)
+        content_ids = sorted({document.content_document_id for document in all_documents})
+        self._sync_library(session, user_id, content_ids, model_id, np.asarray(query_vector).shape[-1])
+        scored = self.faiss_service.search_library(
+            user_id,
+            query_vector,
+            top_k,
+            document_ids=list(document_by_content) if document_ids is not None else None,
+            model=model_id,
+        )
+
+        chunk_by_id = {
+            chunk.id: chunk for chunk in self.repo.list_chunks_by_ids(session, [chunk_id for _, chunk_id, _ in scored])
+        }
+        page_maps: dict[int, dict[int, DocumentPage]] = {}
+        results: list[RetrievalResult] = []
+        for content_id, chunk_id, score in scored:
+            chunk = chunk_by_id.get(chunk_id)
+            if chunk is None or score < min_score or content_id not in document_by_content:
+                continue
+            if content_id not in page_maps:
+                page_maps[content_id] = {page.page_number: page for page in self.repo.list_pages(session, content_id)}
+            results.append(
+                RetrievalResult(
+                    document_id=document_by_content[content_id],
+                    page_number=chunk.page_number,
+                    chunk_index=chunk.chunk_index,
+                    snippet=chunk_text(chunk, page_maps[content_id]) or "",
+                    score=score,
+                )
+            )
+        return results
+
+    def _sync_library(
+        self,
+        session: Session,
+        user_id: int,
+        content_ids: list[int],
+        model_id: str,
+        dim: int,
+    ) -> None:
+        current = self.repo.chunk_ids_by_document(session, content_ids)
+        index, indexed = self.faiss_service.load_library(user_id, model=model_id, dim=dim)
+        remove = [content_id for content_id in indexed if content_id not in current]
+        changed: dict[int, tuple[list[str], list[int]]] = {}
+        for content_id, chunk_ids in current.items():
+            if indexed.get(content_id) == chunk_ids:
+                continue
+            page_map = {page.page_number: page for page in self.repo.list_pages(session, content_id)}
+            chunks, texts = chunk_texts(self.repo.list_chunks(session, content_id), page_map)
+            if texts:
+                changed[content_id] = (texts, [chunk.id for chunk in chunks])
+        vectors = self._chunk_vectors_many(changed, model_id)
+        add = {content_id: (vectors[content_id], ids) for content_id, (_, ids) in changed.items()}
+        if add or remove:
+            self.faiss_service.update_library(user_id, add, remove, model=model_id, reset=index is None)
+
+    def _chunk_vectors(self, content_id: int, texts: list[str], chunk_ids: list[int], model_id: str) -> np.ndarray:
+        # Stored chunk vectors rebuild indexes without calling the model.
+        vectors, stored_ids = self.embedding_store.load(content_id, model=model_id)
+        if vectors is None or stored_ids != chunk_ids:
+            vectors = self.embedding_service.embed_texts(texts)
+            self.embedding_store.save(content_id, vectors, chunk_ids, model=model_id)
+        return vectors
+
+    def _chunk_vectors_many(
+        self,
+        documents: dict[int, tuple[list[str], list[int]]],
+        model_id: str,
+    ) -> dict[int, np.ndarray]:
+        # Like _chunk_vectors for (texts, chunk ids) of several documents; the
+        # ones without stored vectors are embedded in one embed_many call.
+        vectors: dict[int, np.ndarray] = {}
+        missing: list[int] = []
+        for content_id, (_, chunk_ids) in documents.items():
+            stored, stored_ids = self.embedding_store.load(content_id, model=model_id)
+            if stored is not None and stored_ids == chunk_ids:
+                vectors[content_id] = stored
+            else:
+                missing.append(content_id)
+        if missing:
+            embedded = self.embedding_service.embed_many([documents[content_id][0] for content_id in missing])
+            for content_id, document_vectors in zip(missing, embedded):
+                self.embedding_store.save(content_id, document_vectors, documents[content_id][1], model=model_id)
+                vectors[content_id] = document_vectors
+        return vectors
+
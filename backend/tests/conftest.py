@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.db.models import Document
+from app.db.repos.documents import DocumentRepository
+
+
+class DictCache:
+    # In-memory stand-in for EmbeddingCache, keyed by text.
+    def __init__(self):
+        self.store = {}
+
+    def get_many(self, texts, namespace=""):
+        return [self.store.get(text) for text in texts]
+
+    def set_many(self, embeddings, namespace=""):
+        self.store.update(embeddings)
+
+
+@pytest.fixture()
+def dict_cache() -> DictCache:
+    return DictCache()
+
+
+@pytest.fixture()
+def session_factory(tmp_path: Path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine.dispose()
+
+
+@pytest.fixture()
+def session(session_factory):
+    with session_factory() as session:
+        yield session
+
+
+@pytest.fixture()
+def make_document():
+    # Registers a file on disk as a document of user 1.
+    def make(session, path: Path, content_type: str = "application/pdf") -> Document:
+        return DocumentRepository().create(
+            session,
+            user_id=1,
+            filename=path.name,
+            content_type=content_type,
+            file_path=str(path),
+            size_bytes=path.stat().st_size,
+            language="en",
+        )
+
+    return make
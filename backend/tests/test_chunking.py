@@ -0,0 +1,69 @@
+import re
+
+from app.db.models import DocumentChunk, DocumentPage
+from app.services.chunking_service import FixedChunker, SentenceChunker, chunk_ranges, chunk_text
+
+
+class WhitespaceTokenizer:
+    def token_offsets(self, text: str) -> list[int]:
+        return [match.start() for match in re.finditer(r"\S+", text)]
+
+
+def test_fixed_chunker_matches_character_windows():
+    text = "x" * 1200
+    spans = FixedChunker(size=500, overlap=50).add_page(3, text)
+
+    assert [(span.start_offset, span.end_offset) for span in spans] == list(chunk_ranges(text))
+    assert [span.chunk_index for span in spans] == [0, 1, 2]
+    assert all(span.page_number == 3 for span in spans)
+
+
+def test_sentence_chunker_keeps_sentences_whole():
+    text = "One two three four. Five six seven. Eight nine ten eleven twelve. Thirteen."
+    chunker = SentenceChunker(WhitespaceTokenizer(), max_tokens=8)
+
+    spans = chunker.add_page(1, text) + chunker.finish()
+    snippets = [text[span.start_offset : span.end_offset] for span in spans]
+
+    assert snippets == [
+        "One two three four. Five six seven.",
+        "Eight nine ten eleven twelve. Thirteen.",
+    ]
+    assert [span.chunk_index for span in spans] == [0, 1]
+
+
+def test_sentence_chunker_overlaps_and_splits_long_sentences():
+    text = "Alpha beta. Gamma delta. " + " ".join(f"w{i}" for i in range(10)) + "."
+    chunker = SentenceChunker(WhitespaceTokenizer(), max_tokens=4, overlap_tokens=2)
+
+    spans = chunker.add_page(1, text)
+    snippets = [text[span.start_offset : span.end_offset] for span in spans]
+
+    assert snippets[0] == "Alpha beta. Gamma delta."
+    assert snippets[1] == "w0 w1 w2 w3"
+    assert snippets[-1] == "w8 w9."
+    assert all(len(snippet.split()) <= 4 for snippet in snippets)
+
+
+def test_sentence_chunker_can_span_page_breaks():
+    pages = {1: "First page ends mid", 2: "sentence here. Next one."}
+    chunker = SentenceChunker(WhitespaceTokenizer(), max_tokens=7, across_pages=True)
+
+    spans = chunker.add_page(1, pages[1])
+    assert spans == []
+    assert chunker.pending_page == 1
+    spans += chunker.add_page(2, pages[2]) + chunker.finish()
+
+    chunk = DocumentChunk(
+        document_id=1,
+        page_number=spans[0].page_number,
+        chunk_index=spans[0].chunk_index,
+        start_offset=spans[0].start_offset,
+        end_offset=spans[0].end_offset,
+        end_page_number=spans[0].end_page_number,
+    )
+    page_map = {number: DocumentPage(document_id=1, page_number=number, text=text) for number, text in pages.items()}
+
+    assert spans[0].end_page_number == 2
+    assert chunk_text(chunk, page_map) == "First page ends mid\nsentence here."
+    assert chunker.pending_page is None
@@ -74,6 +74,7 @@ def test_init_db_adds_chunk_offsets(tmp_path, monkeypatch) -> None:
         columns = [row[1] for row in conn.execute(text("PRAGMA table_info(document_chunks)"))]
         assert "start_offset" in columns
         assert "end_offset" in columns
+        assert "end_page_number" in columns
         row = conn.execute(
             text("SELECT start_offset, end_offset FROM document_chunks WHERE id = 1")
         ).fetchone()
@@ -85,3 +86,7 @@ def test_init_db_adds_chunk_offsets(tmp_path, monkeypatch) -> None:
             row[1] for row in conn.execute(text("PRAGMA table_info(documents)"))
         ]
         assert "language" in doc_columns
+        assert "extraction_checkpoint" in doc_columns
+        assert "content_hash" in doc_columns
+        assert "extraction_fingerprint" in doc_columns
+        assert "source_document_id" in doc_columns
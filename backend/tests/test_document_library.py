@@ -13,6 +13,7 @@ from app.db.repos.documents import DocumentRepository
 from app.db.session import get_engine, get_session
 from app.main import create_app
 from app.services.document_service import DocumentService
+from app.services.extraction_service import ExtractionService
 
 
 @pytest.fixture()
@@ -190,3 +191,43 @@ def test_sample_dir_falls_back_when_configured_path_missing(tmp_path: Path) -> N
     resolved = service._resolve_sample_dir()
 
     assert resolved.name == "samples"
+
+
+def test_sample_documents_are_shared_by_content_hash(tmp_path: Path) -> None:
+    sample_dir = tmp_path / "samples"
+    sample_dir.mkdir()
+    create_pdf(sample_dir / "shared.pdf", "Shared sample content for every user. " * 4)
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.storage_dir = str(tmp_path / "storage")
+    settings.sample_docs_dir = str(sample_dir)
+    settings.ocr_min_text_length = 0
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    repo = DocumentRepository()
+    service = DocumentService(repo)
+    try:
+        with SessionLocal() as session:
+            service.import_sample_documents(session, user_id=1)
+            service.import_sample_documents(session, user_id=2)
+            [first] = [item.document for item in service.list_documents_for_user(session, 1)]
+            [second] = [item.document for item in service.list_documents_for_user(session, 2)]
+
+            ExtractionService(repo).extract_from_document(session, first)
+            second_item = service.list_documents_for_user(session, 2)[0]
+            second_pages = ExtractionService(repo).extract_from_document(session, second)
+            stored_pages = repo.count_pages(session, first.id) + repo.count_pages(session, second.id)
+    finally:
+        get_settings.cache_clear()
+
+    assert len(list((tmp_path / "storage").iterdir())) == 1
+    assert first.file_path == second.file_path
+    assert first.content_hash == second.content_hash
+    assert second.source_document_id == first.id
+    assert second_item.extraction_status == "extracted"
+    assert second_item.pages_count == 1
+    assert second_pages == (1, 1)
+    assert stored_pages == 1
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from app.core.settings import get_settings
+from app.services.embedding_batcher import QueryBatcher
+from app.services.embedding_service import EmbeddingService
+
+
+class RecordingEncoder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+
+def test_query_batcher_fills_batches_and_flushes_on_window():
+    encoder = RecordingEncoder()
+    batcher = QueryBatcher(encoder, max_batch_size=4, window_seconds=0.2)
+    try:
+        futures = [batcher.submit("x" * length) for length in range(1, 6)]
+        results = [future.result(timeout=5).tolist() for future in futures]
+    finally:
+        batcher.close()
+
+    assert results == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert sorted(len(batch) for batch in encoder.batches) == [1, 4]
+    assert batcher.stats()["texts"] == 5
+
+
+def test_query_batcher_propagates_encode_errors():
+    def failing(texts):
+        raise RuntimeError("model failed")
+
+    batcher = QueryBatcher(failing, window_seconds=0)
+    try:
+        with pytest.raises(RuntimeError, match="model failed"):
+            batcher.embed("query")
+    finally:
+        batcher.close()
+
+
+def test_concurrent_queries_share_one_forward_pass(monkeypatch, dict_cache):
+    encoder = RecordingEncoder()
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.embedding_query_batch_window_ms = 200
+    settings.embedding_query_batch_size = 8
+    cache = dict_cache
+    service = EmbeddingService("batcher-test", cache=cache)
+    monkeypatch.setattr(service, "_encode", encoder)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(service.embed_query, ["q" * length for length in range(1, 9)]))
+    finally:
+        EmbeddingService.evict("batcher-test")
+        get_settings.cache_clear()
+
+    assert [result.tolist() for result in results] == [[float(length)] for length in range(1, 9)]
+    assert len(encoder.batches) == 1
+    assert cache.store["qqq"].tolist() == [3.0]
@@ -1,4 +1,12 @@
-from app.services.embedding_cache import EmbeddingCache
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.core.settings import get_settings
+from app.services.embedding_cache import EmbeddingCache, MemoryTier, decode_embedding, encode_embedding
 from app.services.embedding_service import EmbeddingService
 
 
@@ -12,13 +20,21 @@ class FakeCache(EmbeddingCache):
     def set(self, text: str, embedding: list[float]) -> None:
         self.store[text] = embedding
 
+    def get_many(self, texts: list[str], namespace: str = ""):
+        return [self.store.get(text) for text in texts]
+
+    def set_many(self, embeddings, namespace: str = "") -> None:
+        self.store.update(embeddings)
+
 
 class FakeModel:
     def __init__(self):
         self.calls = []
+        self.batch_sizes = []
 
-    def encode(self, texts, normalize_embeddings=True):
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
         self.calls.append(list(texts))
+        self.batch_sizes.append(batch_size)
         return [[float(len(text))] for text in texts]
 
 
@@ -33,9 +49,8 @@ def test_embedding_service_uses_cache(monkeypatch):
 
     result = service.embed_texts(["hello", "world"])
 
-    assert result[0] == [1.0]
-    assert result[1] == [5.0]
-    assert fake_cache.get("world") == [5.0]
+    assert result.tolist() == [[1.0], [5.0]]
+    assert fake_cache.get("world").tolist() == [5.0]
     assert fake_model.calls == [["world"]]
 
 
@@ -50,5 +65,253 @@ def test_embedding_service_cache_hit_no_model_call(monkeypatch):
 
     result = service.embed_texts(["cached"])
 
-    assert result == [[2.0]]
+    assert result.tolist() == [[2.0]]
     assert fake_model.calls == []
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.round_trips = 0
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.store.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append((key, value))
+
+    def execute(self):
+        self.client.round_trips += 1
+        for key, value in self.commands:
+            self.client.store[key] = value.encode("utf-8") if isinstance(value, str) else value
+
+
+def test_embedding_cache_bulk_operations_use_one_round_trip_each(monkeypatch):
+    cache = EmbeddingCache(redis_url="redis://unused", memory_bytes=0)
+    fake_redis = FakeRedis()
+    cache._client = fake_redis
+    service = EmbeddingService(cache=cache)
+    fake_model = FakeModel()
+    monkeypatch.setattr(service, "_get_model", lambda: fake_model)
+
+    texts = [f"chunk {idx}" for idx in range(100)] + ["chunk 0"]
+    result = service.embed_texts(texts)
+
+    assert fake_redis.round_trips == 2
+    assert sum(len(call) for call in fake_model.calls) == 100
+    assert result.shape == (101, 1)
+    assert result[-1].tolist() == result[0].tolist() == [7.0]
+
+    calls = len(fake_model.calls)
+    assert np.array_equal(service.embed_texts(texts), result)
+    assert fake_redis.round_trips == 3
+    assert len(fake_model.calls) == calls
+
+
+def test_embedding_encoding_is_binary_and_versioned():
+    vector = np.linspace(-1, 1, 384, dtype=np.float32)
+
+    payload = encode_embedding(vector)
+    assert len(payload) == 2 + 384 * 4
+    decoded = decode_embedding(payload)
+    assert decoded.dtype == np.float32
+    assert np.array_equal(decoded, vector)
+
+    half = encode_embedding(vector, "float16")
+    assert len(half) == 2 + 384 * 2
+    assert np.allclose(decode_embedding(half), vector, atol=1e-3)
+
+    legacy = json.dumps(vector.tolist()).encode("utf-8")
+    assert np.allclose(decode_embedding(legacy), vector)
+    assert decode_embedding(b"\x09f" + vector.tobytes()) is None
+
+
+def test_memory_tier_serves_hot_vectors_without_redis():
+    cache = EmbeddingCache(redis_url="redis://unused", memory_bytes=1024)
+    fake_redis = FakeRedis()
+    cache._client = fake_redis
+    fake_redis.store[cache._key("warm")] = encode_embedding(np.ones(4, dtype=np.float32))
+
+    cache.set_many({"hot": np.zeros(4, dtype=np.float32)})
+    assert fake_redis.round_trips == 1
+
+    assert cache.get("hot").tolist() == [0.0] * 4
+    assert fake_redis.round_trips == 1
+    assert cache.get("warm").tolist() == [1.0] * 4
+    assert cache.get("warm").tolist() == [1.0] * 4
+    assert cache.get("cold") is None
+    assert fake_redis.round_trips == 3
+
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["redis_hits"], stats["misses"]) == (2, 1, 1)
+    assert stats["memory_hit_rate"] == 0.5
+
+
+class DownRedis:
+    def mget(self, keys):
+        raise RedisConnectionError("Redis is down")
+
+    def pipeline(self, transaction=True):
+        return DownPipeline()
+
+
+class DownPipeline:
+    def set(self, key, value):
+        pass
+
+    def execute(self):
+        raise RedisConnectionError("Redis is down")
+
+
+def test_memory_tier_keeps_serving_when_redis_is_down(monkeypatch):
+    cache = EmbeddingCache(redis_url="redis://unused", memory_bytes=1024)
+    cache._client = DownRedis()
+    service = EmbeddingService("redis-down-test", cache=cache)
+    fake_model = FakeModel()
+    monkeypatch.setattr(service, "_get_model", lambda: fake_model)
+
+    service.embed_texts(["one", "three", "fifteen"])
+    first_calls = len(fake_model.calls)
+    assert service.embed_texts(["one", "three", "fifteen", "new"]).tolist() == [[3.0], [5.0], [7.0], [3.0]]
+    assert fake_model.calls[first_calls:] == [["new"]]
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"]) == (3, 4)
+
+
+def test_memory_tier_evicts_by_size_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.embedding_cache.time.monotonic", lambda: now[0])
+    tier = MemoryTier(max_bytes=3 * 16, ttl_seconds=60)
+    for key in "abc":
+        tier.set(key, np.zeros(4, dtype=np.float32))
+    assert tier.get("a") is not None
+
+    tier.set("d", np.zeros(4, dtype=np.float32))
+    assert tier.get("b") is None
+    assert [key for key in "acd" if tier.get(key) is not None] == ["a", "c", "d"]
+    assert tier.size_bytes == 48
+
+    now[0] += 61
+    assert tier.get("a") is None
+    assert tier.size_bytes == 32
+
+
+def test_embedding_models_are_loaded_once_per_process(monkeypatch):
+    loaded = []
+
+    class CountingModel(FakeModel):
+        def __init__(self, model_name):
+            super().__init__()
+            loaded.append(model_name)
+
+    monkeypatch.setattr("app.services.embedding_service.SentenceTransformer", CountingModel)
+    EmbeddingService.evict("registry-test")
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(
+                    lambda text: EmbeddingService("registry-test", cache=FakeCache()).embed_query(text),
+                    ["a", "bb", "ccc", "dddd"],
+                )
+            )
+        assert [result.tolist() for result in results] == [[1.0], [2.0], [3.0], [4.0]]
+        assert loaded == ["registry-test"]
+
+        EmbeddingService("registry-test", cache=FakeCache()).warmup()
+        assert loaded == ["registry-test"]
+
+        EmbeddingService.evict("registry-test")
+        EmbeddingService("registry-test", cache=FakeCache()).embed_query("again")
+        assert loaded == ["registry-test", "registry-test"]
+    finally:
+        EmbeddingService.evict("registry-test")
+
+
+def test_onnx_backends_load_with_backend_kwargs_and_check_parity(monkeypatch):
+    created = []
+
+    class BackendModel:
+        def __init__(self, model_name, **kwargs):
+            self.kwargs = kwargs
+            created.append(kwargs)
+
+        def encode(self, texts, batch_size=32, normalize_embeddings=True):
+            skew = 0.0 if not self.kwargs else 0.05
+            return [[float(len(text)), 1.0 + skew] for text in texts]
+
+    monkeypatch.setattr("app.services.embedding_service.SentenceTransformer", BackendModel)
+    EmbeddingService.evict("backend-test")
+    get_settings.cache_clear()
+    try:
+        service = EmbeddingService("backend-test", cache=FakeCache(), backend="onnx-int8")
+        service.embed_query("first use")
+        assert created == [{"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}}, {}]
+        assert ("backend-test", "torch") not in EmbeddingService._model_by_name
+
+        EmbeddingService.evict("backend-test", backend="onnx-int8")
+        torch_model = EmbeddingService("backend-test", cache=FakeCache()).load()
+        created.clear()
+        service.load()
+        assert created == [{"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}}]
+        assert EmbeddingService._model_by_name[("backend-test", "torch")] is torch_model
+
+        EmbeddingService.evict("backend-test", backend="onnx-int8")
+        get_settings().embedding_parity_min_cosine = 1.0
+        with pytest.raises(RuntimeError, match="deviates from torch"):
+            service.embed_query("rejected backend")
+        assert ("backend-test", "onnx-int8") not in EmbeddingService._model_by_name
+        with pytest.raises(ValueError):
+            EmbeddingService("backend-test", backend="tensorrt")
+    finally:
+        EmbeddingService.evict("backend-test")
+        get_settings.cache_clear()
+
+
+class WordTokenizer:
+    def __call__(self, texts, truncation=True, max_length=512):
+        return {"input_ids": [text.split()[:max_length] for text in texts]}
+
+
+def test_misses_are_encoded_in_length_sorted_batches(monkeypatch):
+    fake_model = FakeModel()
+    fake_model.tokenizer = WordTokenizer()
+    get_settings.cache_clear()
+    get_settings().embedding_batch_size = 2
+    service = EmbeddingService(cache=FakeCache())
+    monkeypatch.setattr(service, "_get_model", lambda: fake_model)
+    texts = ["a b c d", "a", "a b c", "a b", "a b c d e"]
+    try:
+        result = service.embed_texts(texts)
+    finally:
+        get_settings.cache_clear()
+
+    assert fake_model.calls == [["a", "a b"], ["a b c", "a b c d"], ["a b c d e"]]
+    assert fake_model.batch_sizes == [2, 2, 1]
+    assert result.tolist() == [[float(len(text))] for text in texts]
+    assert [(timing.size, timing.max_tokens) for timing in service.batch_timings] == [(2, 2), (2, 4), (1, 5)]
+
+
+def test_cache_keys_are_namespaced_by_model(monkeypatch):
+    cache = EmbeddingCache(redis_url="redis://unused", memory_bytes=0)
+    cache._client = FakeRedis()
+    cache.set("text", np.ones(2, dtype=np.float32), namespace="old-model@torch")
+
+    assert cache.get("text", namespace="new-model@torch") is None
+    assert cache.get("text", namespace="old-model@torch").tolist() == [1.0, 1.0]
+
+    service = EmbeddingService("new-model", cache=cache)
+    fake_model = FakeModel()
+    monkeypatch.setattr(service, "_get_model", lambda: fake_model)
+    assert service.embed_texts(["text"]).tolist() == [[4.0]]
+    assert fake_model.calls == [["text"]]
+    assert cache.get("text", namespace="old-model@torch").tolist() == [1.0, 1.0]
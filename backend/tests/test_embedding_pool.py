@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from app.core.settings import get_settings
+from app.services.embedding_pool import EmbeddingPool
+from app.services.embedding_service import EmbeddingService
+
+
+def length_encoder(texts):
+    return np.array([[float(len(text)), float(os.getpid())] for text in texts], dtype=np.float32)
+
+
+def make_length_encoder():
+    return length_encoder
+
+
+def test_embedding_pool_shards_across_workers_and_keeps_order():
+    pool = EmbeddingPool(make_length_encoder, workers=2, shard_size=3)
+    texts = ["x" * length for length in [5, 1, 9, 3, 7, 2, 8, 4, 6, 10]]
+    try:
+        vectors = pool.embed(texts)
+    finally:
+        pool.close()
+
+    assert vectors[:, 0].tolist() == [float(len(text)) for text in texts]
+    assert os.getpid() not in set(vectors[:, 1].tolist())
+
+
+class FakePool:
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+
+def test_large_batches_from_many_documents_go_through_the_pool(monkeypatch, dict_cache):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.embedding_workers = 2
+    settings.embedding_pool_shard_size = 2
+    pool = FakePool()
+    service = EmbeddingService(cache=dict_cache)
+    monkeypatch.setattr(service, "_get_pool", lambda: pool)
+    try:
+        first, second = service.embed_many([["a", "bb"], ["ccc", "a", "dddd"]])
+    finally:
+        get_settings.cache_clear()
+
+    assert pool.calls == [["a", "bb", "ccc", "dddd"]]
+    assert first.tolist() == [[1.0], [2.0]]
+    assert second.tolist() == [[3.0], [1.0], [4.0]]
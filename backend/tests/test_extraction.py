@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import fitz
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
@@ -11,6 +13,9 @@ from app.db.base import Base
 from app.db.repos.documents import DocumentRepository
 from app.db.session import get_engine, get_session
 from app.main import create_app
+from app.services import extraction_service
+from app.services.embedding_store import EmbeddingStore
+from app.services.extraction_service import ExtractionService, PageReadOptions, _page_pools
 
 
 @pytest.fixture()
@@ -121,3 +126,263 @@ def test_extract_pdf_pages_and_chunks(client: TestClient, tmp_path: Path) -> Non
     assert any("Hello page two." in row[1] for row in page_rows)
     assert len(chunk_rows) == 2
     assert all(row[2] < row[3] for row in chunk_rows)
+
+
+@pytest.fixture()
+def page_pools():
+    yield _page_pools
+    for workers in list(_page_pools):
+        _page_pools.pop(workers).shutdown()
+
+
+def test_parallel_extraction_keeps_page_order(session, make_document, page_pools, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "long.pdf"
+    doc = fitz.open()
+    for number in range(1, 6):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Parallel page {number}. " * 8)
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.extraction_workers = 2
+    settings.extraction_pages_per_task = 2
+
+    repo = DocumentRepository()
+    reported: list[tuple[int, int]] = []
+    try:
+        document = make_document(session, pdf_path)
+        service = ExtractionService(repo)
+        pages, _ = service.extract_from_document(
+            session,
+            document,
+            progress=lambda current, total: reported.append((current, total)),
+        )
+        page_rows = repo.list_pages(session, document.id)
+        pool = page_pools[2]
+
+        settings.chunk_size = 100
+        service.extract_from_document(session, document)
+    finally:
+        get_settings.cache_clear()
+
+    assert page_pools[2] is pool
+    assert pages == 5
+    assert [row.page_number for row in page_rows] == [1, 2, 3, 4, 5]
+    for row in page_rows:
+        assert f"Parallel page {row.page_number}." in row.text
+    assert reported[-1] == (5, 5)
+    assert [current for current, _ in reported] == sorted(current for current, _ in reported)
+
+
+def test_parallel_extraction_bounds_batches_in_flight(tmp_path: Path, monkeypatch) -> None:
+    pdf_path = tmp_path / "long.pdf"
+    doc = fitz.open()
+    for number in range(1, 13):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Bounded page {number}. " * 8)
+    doc.save(pdf_path)
+    doc.close()
+
+    submitted: list[int] = []
+
+    class RecordingPool(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            submitted.append(args[1][-1])
+            return super().submit(fn, *args)
+
+    options = PageReadOptions(min_text_length=1, ocr_batch_size=1, text_salt="", ocr_salt="")
+    with RecordingPool(max_workers=2) as pool:
+        monkeypatch.setattr(extraction_service, "_get_page_pool", lambda workers: pool)
+        pages = extraction_service._iter_page_texts_parallel(
+            pdf_path, 12, options, {}, start_page=0, workers=2, batch_size=1
+        )
+        ahead = [max(submitted) - page_index for page_index, _, _ in pages]
+
+    assert sorted(submitted) == list(range(12))
+    assert max(ahead) < 4
+
+
+def test_streaming_extraction_commits_pages_in_batches(session_factory, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "stream.pdf"
+    doc = fitz.open()
+    for number in range(1, 6):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Streamed page {number}. " * 8)
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.extraction_commit_pages = 2
+    settings.ocr_min_text_length = 0
+
+    repo = DocumentRepository()
+    committed: list[int] = []
+
+    def on_progress(current: int, total: int) -> None:
+        with session_factory() as other_session:
+            committed.append(len(repo.list_pages(other_session, document_id)))
+
+    try:
+        with session_factory() as session:
+            document = make_document(session, pdf_path)
+            document_id = document.id
+            pages, chunks = ExtractionService(repo).extract_from_document(
+                session,
+                document,
+                progress=on_progress,
+            )
+            page_rows = repo.list_pages(session, document_id)
+            chunk_rows = repo.list_chunks(session, document_id)
+    finally:
+        get_settings.cache_clear()
+
+    assert committed == [0, 2, 2, 4, 4]
+    assert pages == 5
+    assert len(page_rows) == 5
+    assert chunks == len(chunk_rows)
+
+
+def test_interrupted_extraction_resumes_from_checkpoint(session_factory, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "resume.pdf"
+    doc = fitz.open()
+    for number in range(1, 6):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Resumed page {number}.")
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.extraction_commit_pages = 2
+    settings.ocr_min_text_length = 0
+
+    repo = DocumentRepository()
+
+    def crash_on_page_three(current: int, total: int) -> None:
+        if current == 3:
+            raise RuntimeError("worker restarted")
+
+    reported: list[int] = []
+    try:
+        with session_factory() as session:
+            document = make_document(session, pdf_path)
+            document_id = document.id
+            with pytest.raises(RuntimeError):
+                ExtractionService(repo).extract_from_document(session, document, progress=crash_on_page_three)
+
+        with session_factory() as session:
+            document = repo.get_by_id_for_user(session, document_id, 1)
+            assert document.extraction_checkpoint == 2
+            assert len(repo.list_pages(session, document_id)) == 2
+
+            pages, chunks = ExtractionService(repo).extract_from_document(
+                session,
+                document,
+                progress=lambda current, total: reported.append(current),
+            )
+            page_rows = repo.list_pages(session, document_id)
+            chunk_rows = repo.list_chunks(session, document_id)
+            checkpoint = document.extraction_checkpoint
+    finally:
+        get_settings.cache_clear()
+
+    assert reported == [3, 4, 5]
+    assert (pages, chunks) == (5, 5)
+    assert sorted(row.page_number for row in page_rows) == [1, 2, 3, 4, 5]
+    assert len(chunk_rows) == 5
+    assert checkpoint is None
+
+
+def test_interrupted_extraction_restarts_when_settings_changed(session_factory, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "restart.pdf"
+    doc = fitz.open()
+    for number in range(1, 5):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(72, 72, 540, 720), f"Restarted page {number}. " * 15)
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.extraction_commit_pages = 1
+    settings.ocr_min_text_length = 0
+    settings.chunk_strategy = "fixed"
+    settings.chunk_size = 500
+    settings.chunk_overlap = 0
+
+    repo = DocumentRepository()
+
+    def crash_after_page_two(current: int, total: int) -> None:
+        if current == 2:
+            raise RuntimeError("worker restarted")
+
+    try:
+        with session_factory() as session:
+            document = make_document(session, pdf_path)
+            document_id = document.id
+            with pytest.raises(RuntimeError):
+                ExtractionService(repo).extract_from_document(session, document, progress=crash_after_page_two)
+
+        settings.chunk_size = 100
+        with session_factory() as session:
+            document = repo.get_by_id_for_user(session, document_id, 1)
+            assert document.extraction_checkpoint == 2
+            ExtractionService(repo).extract_from_document(session, document)
+            chunk_rows = repo.list_chunks(session, document_id)
+    finally:
+        get_settings.cache_clear()
+
+    chunks_per_page = {
+        page_number: sum(1 for row in chunk_rows if row.page_number == page_number) for page_number in range(1, 5)
+    }
+    assert max(row.end_offset - row.start_offset for row in chunk_rows) <= 100
+    assert len(set(chunks_per_page.values())) == 1
+    assert chunks_per_page[1] > 1
+
+
+class CountingEmbeddingService:
+    model_id = "fake-model"
+
+    def __init__(self):
+        self.embedded: list[str] = []
+
+    def embed_texts(self, texts: list[str]):
+        self.embedded.extend(texts)
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_extraction_stores_chunk_embeddings(session, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "embed.pdf"
+    doc = fitz.open()
+    for number in range(1, 3):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Embedded page {number}.")
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.ocr_min_text_length = 0
+    settings.extraction_embed_chunks = True
+
+    repo = DocumentRepository()
+    embedding_service = CountingEmbeddingService()
+    embedding_store = EmbeddingStore(str(tmp_path / "embeddings"))
+    service = ExtractionService(repo, embedding_service=embedding_service, embedding_store=embedding_store)
+    try:
+        document = make_document(session, pdf_path)
+        service.extract_from_document(session, document)
+        chunk_ids = [chunk.id for chunk in repo.list_chunks(session, document.id)]
+        service.extract_from_document(session, document)
+        vectors, stored_ids = embedding_store.load(document.id, model="fake-model")
+    finally:
+        get_settings.cache_clear()
+
+    assert embedding_service.embedded == ["Embedded page 1.\n", "Embedded page 2.\n"]
+    assert stored_ids == chunk_ids
+    assert vectors.dtype == np.float32
+    assert vectors[:, 0].tolist() == [17.0, 17.0]
+    assert embedding_store.load(document.id, model="other-model") == (None, [])
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pytest
+
+from app.core.files import write_atomic
+
+
+def test_write_atomic_replaces_file(tmp_path: Path) -> None:
+    path = tmp_path / "meta.json"
+    path.write_text("old")
+
+    write_atomic(path, lambda target: target.write_text("new"))
+
+    assert path.read_text() == "new"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["meta.json"]
+
+
+def test_failed_atomic_write_keeps_old_file(tmp_path: Path) -> None:
+    path = tmp_path / "meta.json"
+    path.write_text("old")
+
+    def failing_write(target: Path) -> None:
+        target.write_text("partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        write_atomic(path, failing_write)
+
+    assert path.read_text() == "old"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["meta.json"]
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.services.ocr_cache import OCRCache
+from app.services.ocr_service import OCRService
+
+
+class FakeReader:
+    def __init__(self):
+        self.calls = 0
+
+    def readtext(self, image):
+        self.calls += 1
+        return [([0, 0], f"text {int(np.asarray(image).mean())}", 0.9)]
+
+    def readtext_batched(self, images):
+        return [self.readtext(image) for image in images]
+
+
+def make_service(monkeypatch, languages: list[str], reader: FakeReader, cache: OCRCache) -> OCRService:
+    monkeypatch.setitem(OCRService._reader_by_languages, tuple(languages), reader)
+    return OCRService(languages=languages, cache=cache)
+
+
+def test_ocr_cache_skips_recognition_on_hit(tmp_path: Path, monkeypatch):
+    cache = OCRCache(backend="disk", cache_dir=str(tmp_path / "ocr"))
+    reader = FakeReader()
+    service = make_service(monkeypatch, ["xx"], reader, cache)
+    pages = [np.full((4, 4, 3), 10, dtype=np.uint8), np.full((4, 4, 3), 20, dtype=np.uint8)]
+
+    first = service.extract_text_from_arrays(pages)
+    second = service.extract_text_from_arrays(pages)
+
+    assert first == second == ["text 10", "text 20"]
+    assert reader.calls == 2
+    assert cache.stats() == {"hits": 2, "misses": 2}
+
+
+def test_ocr_cache_is_keyed_by_language_set(tmp_path: Path, monkeypatch):
+    cache = OCRCache(backend="disk", cache_dir=str(tmp_path / "ocr"))
+    page = np.full((4, 4, 3), 30, dtype=np.uint8)
+    first_reader = FakeReader()
+    second_reader = FakeReader()
+
+    make_service(monkeypatch, ["xx"], first_reader, cache).extract_text_from_array(page)
+    make_service(monkeypatch, ["xx", "yy"], second_reader, cache).extract_text_from_array(page)
+
+    assert first_reader.calls == 1
+    assert second_reader.calls == 1
+    assert cache.stats() == {"hits": 0, "misses": 2}
+
+
+def test_ocr_cache_disabled_backend_always_recognizes(tmp_path: Path, monkeypatch):
+    cache = OCRCache(backend="none")
+    reader = FakeReader()
+    service = make_service(monkeypatch, ["zz"], reader, cache)
+    page = np.zeros((4, 4, 3), dtype=np.uint8)
+
+    service.extract_text_from_array(page)
+    service.extract_text_from_array(page)
+
+    assert reader.calls == 2
+    assert cache.stats() == {"hits": 0, "misses": 0}
+
+
+def test_ocr_readers_are_created_once_per_language_set(monkeypatch):
+    created: list[tuple[list[str], bool]] = []
+
+    class CountingReader(FakeReader):
+        def __init__(self, languages, gpu=True):
+            super().__init__()
+            self.batches: list[int] = []
+            created.append((languages, gpu))
+
+        def readtext_batched(self, images):
+            self.batches.append(len(images))
+            return super().readtext_batched(images)
+
+    monkeypatch.setattr("app.services.ocr_service.easyocr.Reader", CountingReader)
+    monkeypatch.setattr(OCRService, "_reader_by_languages", {})
+    cache = OCRCache(backend="none")
+
+    first = OCRService(languages=["en", "hr"], cache=cache)
+    second = OCRService(languages=["en", "hr"], cache=cache)
+    pages = [
+        np.full((4, 4, 3), 10, dtype=np.uint8),
+        np.full((6, 4, 3), 20, dtype=np.uint8),
+        np.full((4, 4, 3), 30, dtype=np.uint8),
+    ]
+
+    assert first.extract_text_from_arrays(pages) == ["text 10", "text 20", "text 30"]
+    assert second.extract_text_from_array(pages[1]) == "text 20"
+    assert second.reader is first.reader
+    assert created == [(["en", "hr"], False)]
+    # Same-sized pages share one batched call; the odd one is read alone.
+    assert first.reader.batches == [2]
+
+    OCRService(languages=["en"], cache=cache).load()
+    assert created == [(["en", "hr"], False), (["en"], False)]
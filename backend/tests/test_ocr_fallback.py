@@ -2,6 +2,7 @@ from pathlib import Path
 from unittest.mock import MagicMock
 
 import fitz
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
@@ -12,6 +13,7 @@ from app.db.base import Base
 from app.db.repos.documents import DocumentRepository
 from app.db.session import get_engine, get_session
 from app.main import create_app
+from app.services import extraction_service
 from app.services.extraction_service import ExtractionService
 
 
@@ -93,7 +95,7 @@ def test_ocr_fallback_on_empty_page(client: TestClient, tmp_path: Path, monkeypa
         document_id = document.id
 
     ocr_mock = MagicMock()
-    ocr_mock.extract_text_from_image.return_value = "OCR text"
+    ocr_mock.extract_text_from_arrays.return_value = ["OCR text"]
     monkeypatch.setattr(
         "app.services.extraction_service.OCRService",
         lambda: ocr_mock,
@@ -105,7 +107,11 @@ def test_ocr_fallback_on_empty_page(client: TestClient, tmp_path: Path, monkeypa
     )
 
     assert response.status_code == 200
-    assert ocr_mock.extract_text_from_image.called
+    assert ocr_mock.extract_text_from_arrays.called
+    [image] = ocr_mock.extract_text_from_arrays.call_args.args[0]
+    assert isinstance(image, np.ndarray)
+    assert image.ndim == 3
+    assert not list(tmp_path.glob("*_page_*.png"))
 
     with SessionLocal() as session:
         page_text = session.execute(
@@ -159,3 +165,176 @@ def test_ocr_for_image_upload(client: TestClient, tmp_path: Path, monkeypatch) -
             {"doc": document_id},
         ).one()[0]
     assert page_text == "Image OCR"
+
+
+class FakeBatchOCRService:
+    def __init__(self):
+        self.batches = []
+
+    def extract_text_from_arrays(self, images):
+        self.batches.append(len(images))
+        return [f"scan {len(self.batches)}.{idx}" for idx in range(len(images))]
+
+
+def test_ocr_fallback_batches_scanned_pages(session, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "mixed.pdf"
+    doc = fitz.open()
+    doc.new_page()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Native text layer. " * 10)
+    doc.new_page()
+    doc.new_page()
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.ocr_batch_size = 2
+
+    repo = DocumentRepository()
+    ocr_service = FakeBatchOCRService()
+    try:
+        document = make_document(session, pdf_path)
+        ExtractionService(repo, ocr_service=ocr_service).extract_from_document(session, document)
+        page_texts = [page.text for page in repo.list_pages(session, document.id)]
+    finally:
+        get_settings.cache_clear()
+
+    assert ocr_service.batches == [2, 1]
+    assert page_texts[0] == "scan 1.0"
+    assert "Native text layer." in page_texts[1]
+    assert page_texts[2:] == ["scan 1.1", "scan 2.0"]
+
+
+def test_scanned_page_does_not_hold_back_following_pages(
+    session_factory, make_document, tmp_path: Path, monkeypatch
+) -> None:
+    pdf_path = tmp_path / "scan_first.pdf"
+    doc = fitz.open()
+    doc.new_page()
+    for number in range(1, 11):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Text page {number}. " * 10)
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.ocr_batch_size = 2
+    settings.extraction_commit_pages = 2
+
+    read_pages: list[int] = []
+    plan_page_ocr = extraction_service._plan_page_ocr
+
+    def recording_plan(page, text, options):
+        read_pages.append(page.number)
+        return plan_page_ocr(page, text, options)
+
+    monkeypatch.setattr(extraction_service, "_plan_page_ocr", recording_plan)
+
+    repo = DocumentRepository()
+    ocr_service = FakeBatchOCRService()
+    snapshots: list[tuple[int, int]] = []
+
+    def on_progress(current: int, total: int) -> None:
+        with session_factory() as other_session:
+            snapshots.append((len(read_pages), len(repo.list_pages(other_session, document_id))))
+
+    try:
+        with session_factory() as session:
+            document = make_document(session, pdf_path)
+            document_id = document.id
+            ExtractionService(repo, ocr_service=ocr_service).extract_from_document(
+                session,
+                document,
+                progress=on_progress,
+            )
+    finally:
+        get_settings.cache_clear()
+
+    assert ocr_service.batches == [1]
+    assert snapshots[0][0] < 11
+    assert any(committed > 0 and read < 11 for read, committed in snapshots)
+
+
+def test_reextraction_only_rebuilds_changed_pages(session, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "mixed.pdf"
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Native text layer. " * 10)
+    doc.new_page()
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+
+    repo = DocumentRepository()
+    ocr_service = FakeBatchOCRService()
+    service = ExtractionService(repo, ocr_service=ocr_service)
+    try:
+        document = make_document(session, pdf_path)
+        counts = service.extract_from_document(session, document)
+        assert counts[0] == 2
+        first_pages = {
+            page.page_number: (page.id, page.fingerprint) for page in repo.list_pages(session, document.id)
+        }
+        assert ocr_service.batches == [1]
+
+        assert service.extract_from_document(session, document) == counts
+        assert ocr_service.batches == [1]
+
+        settings.ocr_languages = ["en"]
+        assert service.extract_from_document(session, document) == counts
+        pages = {page.page_number: page for page in repo.list_pages(session, document.id)}
+    finally:
+        get_settings.cache_clear()
+
+    assert ocr_service.batches == [1, 1]
+    assert (pages[1].id, pages[1].fingerprint) == first_pages[1]
+    assert pages[2].fingerprint != first_pages[2][1]
+    assert pages[2].text == "scan 2.0"
+
+
+class ShapeRecordingOCRService:
+    def __init__(self):
+        self.shapes = []
+
+    def extract_text_from_arrays(self, images):
+        self.shapes.extend(image.shape for image in images)
+        return [f"region {idx}" for idx in range(len(images))]
+
+
+def test_region_ocr_merges_image_text_with_text_layer(session, make_document, tmp_path: Path) -> None:
+    pdf_path = tmp_path / "figure.pdf"
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Text above the figure. " * 8)
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 50, 20), False)
+    pixmap.clear_with(200)
+    page.insert_image(fitz.Rect(72, 100, 272, 180), pixmap=pixmap)
+    page.insert_image(fitz.Rect(72, 200, 82, 210), pixmap=pixmap)
+    page.insert_text((72, 260), "Text below the figure.")
+    doc.save(pdf_path)
+    doc.close()
+
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.ocr_mode = "regions"
+    settings.ocr_region_dpi = 144
+
+    repo = DocumentRepository()
+    ocr_service = ShapeRecordingOCRService()
+    try:
+        document = make_document(session, pdf_path)
+        ExtractionService(repo, ocr_service=ocr_service).extract_from_document(session, document)
+        [page_text] = [page.text for page in repo.list_pages(session, document.id)]
+    finally:
+        get_settings.cache_clear()
+
+    # Only the 200x80pt figure is rendered (at 2x), the 10pt icon is skipped.
+    assert ocr_service.shapes == [(160, 400, 3)]
+    lines = page_text.split("\n")
+    assert lines[0].startswith("Text above the figure.")
+    assert lines[1] == "region 0"
+    assert lines[2] == "Text below the figure."
@@ -1,17 +1,20 @@
 from pathlib import Path
 
+import faiss
+import numpy as np
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-from app.db.base import Base
+from app.core.settings import get_settings
 from app.db.models import DocumentChunk, DocumentPage
 from app.db.repos.documents import DocumentRepository
-from app.services.faiss_service import FaissService
+from app.services.embedding_store import EmbeddingStore
+from app.services.faiss_service import MMAP_READ_FLAGS, FaissService, IndexCache, compression_report
 from app.services.retrieval_service import RetrievalService
 
 
 class FakeEmbeddingService:
+    model_id = "fake-model"
+
     def embed_texts(self, texts: list[str]) -> list[list[float]]:
         return [[float(len(text))] for text in texts]
 
@@ -19,16 +22,6 @@ class FakeEmbeddingService:
         return [float(len(text))]
 
 
-@pytest.fixture()
-def session(tmp_path: Path):
-    db_path = tmp_path / "test.db"
-    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
-    Base.metadata.create_all(bind=engine)
-    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-    with SessionLocal() as session:
-        yield session
-
-
 def test_retrieval_returns_relevant_chunk(session, tmp_path: Path):
     repo = DocumentRepository()
 
@@ -57,6 +50,7 @@ def test_retrieval_returns_relevant_chunk(session, tmp_path: Path):
         repo,
         embedding_service=FakeEmbeddingService(),
         faiss_service=faiss_service,
+        embedding_store=EmbeddingStore(str(tmp_path / "embeddings")),
     )
     results = service.retrieve(session, doc.id, "zebra", top_k=1)
 
@@ -92,7 +86,439 @@ def test_retrieval_empty_query_returns_no_results(session, tmp_path: Path):
         repo,
         embedding_service=FakeEmbeddingService(),
         faiss_service=faiss_service,
+        embedding_store=EmbeddingStore(str(tmp_path / "embeddings")),
     )
     results = service.retrieve(session, doc.id, "   ", top_k=1)
 
     assert results == []
+
+
+def test_faiss_index_is_rebuilt_when_embedding_model_changes(session, tmp_path: Path):
+    repo = DocumentRepository()
+    doc = repo.create(
+        session,
+        user_id=1,
+        filename="doc.pdf",
+        content_type="application/pdf",
+        file_path="/tmp/doc.pdf",
+        size_bytes=10,
+    )
+    page_text = "alpha beta gamma delta epsilon zebra tiger"
+    page = DocumentPage(document_id=doc.id, page_number=1, text=page_text)
+    chunk = DocumentChunk(
+        document_id=doc.id,
+        page_number=1,
+        chunk_index=0,
+        start_offset=0,
+        end_offset=len(page_text),
+    )
+    repo.replace_pages_and_chunks(session, doc.id, [page], [chunk])
+
+    class CountingEmbeddingService(FakeEmbeddingService):
+        def __init__(self, model_id: str, dim: int = 1):
+            self.model_id = model_id
+            self.dim = dim
+            self.embedded = 0
+
+        def embed_texts(self, texts: list[str]) -> list[list[float]]:
+            self.embedded += len(texts)
+            return [[float(len(text))] * self.dim for text in texts]
+
+        def embed_query(self, text: str) -> list[float]:
+            return [float(len(text))] * self.dim
+
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"))
+    embedding_store = EmbeddingStore(str(tmp_path / "embeddings"))
+    old_model = CountingEmbeddingService("old-model")
+    old_service = RetrievalService(
+        repo, embedding_service=old_model, faiss_service=faiss_service, embedding_store=embedding_store
+    )
+    old_service.retrieve(session, doc.id, "zebra")
+    old_service.retrieve(session, doc.id, "tiger")
+    assert old_model.embedded == 1
+
+    new_model = CountingEmbeddingService("new-model", dim=2)
+    results = RetrievalService(
+        repo, embedding_service=new_model, faiss_service=faiss_service, embedding_store=embedding_store
+    ).retrieve(
+        session, doc.id, "zebra"
+    )
+    assert new_model.embedded == 1
+    assert len(results) == 1
+    index, ids = faiss_service.load_index(doc.id, model="new-model", dim=2)
+    assert index.d == 2
+    assert ids == [chunk.id]
+    assert faiss_service.load_index(doc.id, model="old-model") == (None, [])
+
+
+def test_lost_index_is_rebuilt_from_stored_embeddings(session, tmp_path: Path):
+    repo = DocumentRepository()
+    doc = repo.create(
+        session,
+        user_id=1,
+        filename="doc.pdf",
+        content_type="application/pdf",
+        file_path="/tmp/doc.pdf",
+        size_bytes=10,
+    )
+    page_text = "alpha beta gamma delta epsilon zebra tiger"
+    page = DocumentPage(document_id=doc.id, page_number=1, text=page_text)
+    chunk = DocumentChunk(
+        document_id=doc.id,
+        page_number=1,
+        chunk_index=0,
+        start_offset=0,
+        end_offset=len(page_text),
+    )
+    repo.replace_pages_and_chunks(session, doc.id, [page], [chunk])
+    embedding_store = EmbeddingStore(str(tmp_path / "embeddings"))
+    embedding_store.save(doc.id, np.array([[1.0]], dtype=np.float32), [chunk.id], model="fake-model")
+
+    class QueryOnlyEmbeddingService(FakeEmbeddingService):
+        def embed_texts(self, texts: list[str]) -> list[list[float]]:
+            raise AssertionError("chunks should not be re-encoded")
+
+    results = RetrievalService(
+        repo,
+        embedding_service=QueryOnlyEmbeddingService(),
+        faiss_service=FaissService(index_dir=str(tmp_path / "faiss")),
+        embedding_store=embedding_store,
+    ).retrieve(session, doc.id, "zebra", top_k=1)
+
+    assert [result.snippet for result in results] == [page_text]
+
+
+def test_embedding_store_pairs_vectors_with_ids_of_the_same_save(tmp_path: Path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path / "embeddings"))
+    store.save(1, np.ones((2, 4), dtype=np.float32), [10, 11], model="fake-model")
+    read_meta = store._read_meta
+    saved_between = []
+
+    def racing_read_meta(document_id):
+        meta = read_meta(document_id)
+        if not saved_between:
+            saved_between.append(True)
+            store.save(1, np.zeros((2, 4), dtype=np.float32), [20, 21], model="fake-model")
+        return meta
+
+    monkeypatch.setattr(store, "_read_meta", racing_read_meta)
+    vectors, ids = store.load(1, model="fake-model")
+
+    assert ids == [20, 21]
+    assert not vectors.any()
+    assert len(list((tmp_path / "embeddings").glob("doc_1.*.npy"))) == 1
+
+
+def test_faiss_service_keeps_loaded_indexes_in_memory(tmp_path: Path, monkeypatch):
+    reads: list[str] = []
+    read_index = faiss.read_index
+
+    def counting_read_index(path, *args):
+        reads.append(path)
+        return read_index(path, *args)
+
+    monkeypatch.setattr(faiss, "read_index", counting_read_index)
+    cache = IndexCache(max_bytes=1024 * 1024)
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"), cache=cache)
+    faiss_service.save_index(1, np.eye(2, dtype=np.float32), [10, 11], model="m")
+
+    assert faiss_service.load_index(1, model="m")[1] == [10, 11]
+    assert faiss_service.search(1, np.array([0.0, 1.0]), 1) == [(11, 1.0)]
+    assert len(reads) == 1
+
+    faiss_service.save_index(1, np.eye(2, dtype=np.float32)[::-1], [20, 21], model="m")
+    assert faiss_service.search(1, np.array([0.0, 1.0]), 1) == [(20, 1.0)]
+    assert len(reads) == 2
+
+    FaissService(index_dir=str(tmp_path / "faiss"), cache=cache).save_index(
+        2, np.eye(2, dtype=np.float32), [30, 31], model="m"
+    )
+    small = IndexCache(max_bytes=cache.size_bytes)
+    other = FaissService(index_dir=str(tmp_path / "faiss"), cache=small)
+    other.load_index(1)
+    other.load_index(2)
+    other.load_index(1)
+    assert (small.hits, small.misses) == (0, 3)
+
+
+def test_faiss_service_can_memory_map_indexes(tmp_path: Path, monkeypatch):
+    flags: list[tuple] = []
+    read_index = faiss.read_index
+
+    def recording_read_index(path, *args):
+        flags.append(args)
+        return read_index(path, *args)
+
+    monkeypatch.setattr(faiss, "read_index", recording_read_index)
+    cache = IndexCache(max_bytes=1024 * 1024)
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"), cache=cache, mmap=True)
+    faiss_service.save_index(1, np.eye(3, dtype=np.float32), [10, 11, 12], model="m")
+
+    assert faiss_service.search(1, np.array([0.0, 0.0, 1.0]), 1) == [(12, 1.0)]
+    assert flags == [(MMAP_READ_FLAGS,)]
+    assert cache.size_bytes == (tmp_path / "faiss" / "doc_1.json").stat().st_size
+
+    faiss_service.save_index(1, np.eye(3, dtype=np.float32)[::-1], [20, 21, 22], model="m")
+    assert faiss_service.search(1, np.array([0.0, 0.0, 1.0]), 1) == [(20, 1.0)]
+
+    flags.clear()
+    faiss_service.update_library(1, {5: (np.eye(3, dtype=np.float32), [50, 51, 52])}, [], model="m")
+    assert faiss_service.search_library(1, np.array([0.0, 1.0, 0.0]), 1, model="m") == [(5, 51, 1.0)]
+    assert flags == [(MMAP_READ_FLAGS,)]
+
+
+def _unit_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_large_indexes_switch_to_approximate_search(tmp_path: Path):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_hnsw_threshold = 500
+    settings.faiss_ivf_threshold = 2000
+    settings.faiss_ivf_nprobe = 64
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"), cache=IndexCache(max_bytes=64 * 1024 * 1024))
+    try:
+        types = {}
+        for document_id, count in [(1, 100), (2, 1000), (3, 4000)]:
+            vectors = _unit_vectors(count, 16, seed=document_id)
+            ids = list(range(document_id * 10_000, document_id * 10_000 + count))
+            faiss_service.save_index(document_id, vectors, ids, model="m")
+            index, _ = faiss_service.load_index(document_id, model="m")
+            types[document_id] = type(index)
+            positions = range(0, count, count // 50)
+            queries = vectors[positions] + 0.05 * _unit_vectors(len(positions), 16, seed=99)
+            hits = sum(
+                faiss_service.search(document_id, query, 1)[0][0] == ids[position]
+                for position, query in zip(positions, queries)
+            )
+            assert hits >= 0.9 * len(positions)
+    finally:
+        get_settings.cache_clear()
+
+    assert types == {1: faiss.IndexFlatIP, 2: faiss.IndexHNSWFlat, 3: faiss.IndexIVFFlat}
+
+
+def test_growing_library_index_switches_to_ivf(tmp_path: Path):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_hnsw_threshold = 300
+    settings.faiss_ivf_nprobe = 64
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"), cache=IndexCache(max_bytes=64 * 1024 * 1024))
+    vectors = _unit_vectors(600, 8)
+    try:
+        faiss_service.update_library(1, {1: (vectors[:200], list(range(200)))}, [], model="m")
+        assert isinstance(faiss_service.load_library(1)[0], faiss.IndexIDMap2)
+
+        faiss_service.update_library(1, {2: (vectors[200:], list(range(200, 600)))}, [], model="m")
+        index, documents = faiss_service.load_library(1, model="m")
+        assert isinstance(index, faiss.IndexIVFFlat)
+        assert index.ntotal == 600
+        assert faiss_service.search_library(1, vectors[250], 1, model="m")[0][:2] == (2, 250)
+        assert faiss_service.search_library(1, vectors[250], 1, document_ids=[1], model="m")[0][0] == 1
+
+        faiss_service.update_library(1, {}, [1], model="m")
+        index, documents = faiss_service.load_library(1, model="m")
+        assert index.ntotal == 400
+        assert list(documents) == [2]
+    finally:
+        get_settings.cache_clear()
+
+
+def _clustered_vectors(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, dim))
+    vectors = centers[rng.integers(0, 20, count)] + 0.6 * rng.standard_normal((count, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_compressed_index_is_reranked_with_stored_vectors(tmp_path: Path):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_compression = "pq"
+    settings.faiss_pq_m = 8
+    vectors = _clustered_vectors(600, 32)
+    ids = list(range(1000, 1600))
+    store = EmbeddingStore(str(tmp_path / "embeddings"))
+    store.save(1, vectors, ids, model="m")
+    faiss_service = FaissService(
+        index_dir=str(tmp_path / "faiss"),
+        cache=IndexCache(max_bytes=1024 * 1024),
+        embedding_store=store,
+    )
+    try:
+        faiss_service.save_index(1, vectors, ids, model="m")
+        index, _ = faiss_service.load_index(1, model="m")
+        assert isinstance(index, faiss.IndexPQ)
+
+        query = vectors[7]
+        results = faiss_service.search(1, query, 3)
+        assert results[0] == (1007, pytest.approx(1.0, abs=1e-5))
+        assert [score for _, score in results] == pytest.approx(
+            [float(vectors[chunk_id - 1000] @ query) for chunk_id, _ in results]
+        )
+
+        settings.faiss_compression = "sq8"
+        assert faiss_service.load_index(1, model="m") == (None, [])
+    finally:
+        get_settings.cache_clear()
+
+
+def test_reranking_reuses_cached_stored_vectors(tmp_path: Path, monkeypatch):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_compression = "sq8"
+    vectors = _clustered_vectors(300, 32)
+    ids = list(range(300))
+    store = EmbeddingStore(str(tmp_path / "embeddings"))
+    store.save(1, vectors, ids, model="m")
+    loads: list[int] = []
+    load = store.load
+
+    def counting_load(document_id, model):
+        loads.append(document_id)
+        return load(document_id, model)
+
+    monkeypatch.setattr(store, "load", counting_load)
+    faiss_service = FaissService(
+        index_dir=str(tmp_path / "faiss"),
+        cache=IndexCache(max_bytes=1024 * 1024),
+        embedding_store=store,
+    )
+    try:
+        faiss_service.save_index(1, vectors, ids, model="m")
+        faiss_service.search(1, vectors[3], 3)
+        faiss_service.search(1, vectors[4], 3)
+        assert loads == [1]
+
+        store.save(1, vectors[::-1], ids[::-1], model="m")
+        results = faiss_service.search(1, vectors[5], 1)
+    finally:
+        get_settings.cache_clear()
+
+    assert loads == [1, 1]
+    assert results == [(5, pytest.approx(1.0, abs=1e-5))]
+
+
+def test_new_library_index_is_compressed(tmp_path: Path):
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_compression = "pq"
+    settings.faiss_pq_m = 8
+    vectors = _clustered_vectors(400, 32)
+    store = EmbeddingStore(str(tmp_path / "embeddings"))
+    store.save(1, vectors[:300], list(range(300)), model="m")
+    store.save(2, vectors[300:], list(range(300, 400)), model="m")
+    faiss_service = FaissService(
+        index_dir=str(tmp_path / "faiss"),
+        cache=IndexCache(max_bytes=1024 * 1024),
+        embedding_store=store,
+    )
+    try:
+        faiss_service.update_library(
+            1,
+            {1: (vectors[:300], list(range(300))), 2: (vectors[300:], list(range(300, 400)))},
+            [],
+            model="m",
+        )
+        index, _ = faiss_service.load_library(1, model="m")
+        assert isinstance(index, faiss.IndexIDMap2)
+        assert isinstance(faiss.downcast_index(index.index), faiss.IndexPQ)
+
+        results = faiss_service.search_library(1, vectors[350], 2, model="m")
+        assert results[0] == (2, 350, pytest.approx(1.0, abs=1e-5))
+        assert results[1][2] == pytest.approx(float(vectors[results[1][1]] @ vectors[350]), abs=1e-5)
+    finally:
+        get_settings.cache_clear()
+
+
+def test_compression_report_trades_memory_for_recall():
+    get_settings.cache_clear()
+    settings = get_settings()
+    settings.faiss_pq_m = 4
+    vectors = _clustered_vectors(3000, 64)
+    queries = vectors[:50] + 0.05 * _unit_vectors(50, 64, seed=1)
+    try:
+        reports = {report.compression: report for report in compression_report(vectors, queries, top_k=5)}
+    finally:
+        get_settings.cache_clear()
+
+    assert list(reports) == ["none", "fp16", "sq8", "pq"]
+    assert reports["none"].recall == 1.0
+    assert reports["none"].bytes > reports["fp16"].bytes > reports["sq8"].bytes > reports["pq"].bytes
+    assert reports["fp16"].recall >= 0.99
+    for report in reports.values():
+        assert report.reranked_recall >= report.recall
+
+
+class KeywordEmbeddingService:
+    model_id = "keyword-model"
+
+    def __init__(self):
+        self.embedded: list[str] = []
+        self.batches: list[list[list[str]]] = []
+
+    def _vector(self, text: str) -> list[float]:
+        return [1.0, 0.0] if "zebra" in text else [0.0, 1.0]
+
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_many(self, text_lists: list[list[str]]) -> list[np.ndarray]:
+        self.batches.append(text_lists)
+        return [np.array(self.embed_texts(texts), dtype=np.float32) for texts in text_lists]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._vector(text)
+
+
+def test_library_search_covers_all_documents_with_one_index(session, tmp_path: Path):
+    repo = DocumentRepository()
+    document_ids = []
+    for text in ["zebra stripes", "tiger stripes", "zebra crossing"]:
+        doc = repo.create(
+            session,
+            user_id=1,
+            filename=f"{text}.pdf",
+            content_type="application/pdf",
+            file_path=f"/tmp/{text}.pdf",
+            size_bytes=len(text),
+        )
+        page = DocumentPage(document_id=doc.id, page_number=1, text=text)
+        chunk = DocumentChunk(document_id=doc.id, page_number=1, chunk_index=0, start_offset=0, end_offset=len(text))
+        repo.replace_pages_and_chunks(session, doc.id, [page], [chunk])
+        document_ids.append(doc.id)
+
+    embedding_service = KeywordEmbeddingService()
+    faiss_service = FaissService(index_dir=str(tmp_path / "faiss"), cache=IndexCache(max_bytes=1024 * 1024))
+    service = RetrievalService(
+        repo,
+        embedding_service=embedding_service,
+        faiss_service=faiss_service,
+        embedding_store=EmbeddingStore(str(tmp_path / "embeddings")),
+    )
+
+    results = service.retrieve_library(session, 1, "zebra", top_k=2)
+    assert sorted(result.document_id for result in results) == [document_ids[0], document_ids[2]]
+    assert {result.snippet for result in results} == {"zebra stripes", "zebra crossing"}
+    assert list((tmp_path / "faiss").glob("doc_*.index")) == []
+    assert embedding_service.batches == [[["zebra stripes"], ["tiger stripes"], ["zebra crossing"]]]
+
+    filtered = service.retrieve_library(session, 1, "zebra", top_k=2, document_ids=[document_ids[1]])
+    assert [(result.document_id, result.snippet) for result in filtered] == [(document_ids[1], "tiger stripes")]
+    assert len(embedding_service.embedded) == 3
+
+    text = "zebra herd"
+    page = DocumentPage(document_id=document_ids[1], page_number=1, text=text)
+    chunk = DocumentChunk(
+        document_id=document_ids[1], page_number=1, chunk_index=0, start_offset=0, end_offset=len(text)
+    )
+    repo.replace_pages_and_chunks(session, document_ids[1], [page], [chunk])
+    results = service.retrieve_library(session, 1, "zebra", top_k=3)
+    assert {result.snippet for result in results} == {"zebra stripes", "zebra herd", "zebra crossing"}
+    assert embedding_service.embedded[3:] == ["zebra herd"]
+    index, documents = faiss_service.load_library(1)
+    assert index.ntotal == 3
+    assert documents[document_ids[1]] == [chunk.id]
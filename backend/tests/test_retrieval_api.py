@@ -1,5 +1,7 @@
+import zlib
 from pathlib import Path
 
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
@@ -11,14 +13,20 @@ from app.db.models import DocumentChunk, DocumentPage
 from app.db.repos.documents import DocumentRepository
 from app.db.session import get_engine, get_session
 from app.main import create_app
+from app.routers import retrieval as retrieval_router
 from app.routers.retrieval import get_retrieval_service
 from app.services.retrieval_service import RetrievalService
 
 
 class FakeEmbeddingService:
+    model_id = "fake-model"
+
     def embed_texts(self, texts: list[str]) -> list[list[float]]:
         return [[float(len(text))] for text in texts]
 
+    def embed_many(self, text_lists: list[list[str]]) -> list[list[list[float]]]:
+        return [self.embed_texts(texts) for texts in text_lists]
+
     def embed_query(self, text: str) -> list[float]:
         return [float(len(text))]
 
@@ -37,6 +45,7 @@ def client(tmp_path: Path):
     settings.sample_docs_dir = str(sample_dir)
     settings.qa_load_on_startup = False
     settings.faiss_index_dir = str(tmp_path / "faiss")
+    settings.embedding_store_dir = str(tmp_path / "embeddings")
 
     get_engine.cache_clear()
 
@@ -156,3 +165,122 @@ def test_search_endpoint_min_score_filters(client: TestClient) -> None:
 
     assert response.status_code == 200
     assert response.json()["results"] == []
+
+
+def test_library_search_endpoint_filters_documents(client: TestClient) -> None:
+    token = register_and_login(client)
+
+    SessionLocal = client.app.state.sessionmaker
+    repo = DocumentRepository()
+    document_ids = []
+    with SessionLocal() as session:
+        user_id = session.execute(
+            text("SELECT id FROM users WHERE email = :email"),
+            {"email": "search@example.com"},
+        ).one()[0]
+        for page_text in ["short page", "a somewhat longer page of text"]:
+            document = repo.create(
+                session,
+                user_id=user_id,
+                filename=f"{len(page_text)}.pdf",
+                content_type="application/pdf",
+                file_path="/tmp/doc.pdf",
+                size_bytes=len(page_text),
+            )
+            page = DocumentPage(document_id=document.id, page_number=1, text=page_text)
+            chunk = DocumentChunk(
+                document_id=document.id,
+                page_number=1,
+                chunk_index=0,
+                start_offset=0,
+                end_offset=len(page_text),
+            )
+            repo.replace_pages_and_chunks(session, document.id, [page], [chunk])
+            document_ids.append(document.id)
+
+    response = client.post(
+        "/search",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"query": "page", "top_k": 5, "document_ids": [document_ids[0]]},
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(result["document_id"], result["snippet"]) for result in results] == [(document_ids[0], "short page")]
+
+
+class HashingEmbeddingService:
+    model_id = "hashing-model"
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(16).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def embed_texts(self, texts: list[str]) -> np.ndarray:
+        return np.stack([self._vector(text) for text in texts])
+
+    def embed_many(self, text_lists: list[list[str]]) -> list[np.ndarray]:
+        return [self.embed_texts(texts) for texts in text_lists]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._vector(text)
+
+
+def test_search_endpoints_rerank_compressed_indexes(client: TestClient, monkeypatch) -> None:
+    settings = get_settings()
+    settings.faiss_compression = "pq"
+    settings.faiss_pq_m = 4
+    monkeypatch.setattr(retrieval_router, "EmbeddingService", HashingEmbeddingService)
+    client.app.dependency_overrides.pop(get_retrieval_service)
+    token = register_and_login(client)
+
+    SessionLocal = client.app.state.sessionmaker
+    repo = DocumentRepository()
+    words = [f"word{number:03d}" for number in range(300)]
+    page_text = " ".join(words)
+    with SessionLocal() as session:
+        user_id = session.execute(
+            text("SELECT id FROM users WHERE email = :email"),
+            {"email": "search@example.com"},
+        ).one()[0]
+        document = repo.create(
+            session,
+            user_id=user_id,
+            filename="words.pdf",
+            content_type="application/pdf",
+            file_path="/tmp/words.pdf",
+            size_bytes=len(page_text),
+        )
+        page = DocumentPage(document_id=document.id, page_number=1, text=page_text)
+        chunks = [
+            DocumentChunk(
+                document_id=document.id,
+                page_number=1,
+                chunk_index=index,
+                start_offset=index * 8,
+                end_offset=index * 8 + 7,
+            )
+            for index in range(len(words))
+        ]
+        repo.replace_pages_and_chunks(session, document.id, [page], chunks)
+        document_id = document.id
+
+    embedder = HashingEmbeddingService()
+    query = "word042"
+    headers = {"Authorization": f"Bearer {token}"}
+    document_results = client.post(
+        f"/documents/{document_id}/search",
+        headers=headers,
+        json={"query": query, "top_k": 3, "min_score": -1.0, "offset": 0},
+    ).json()["results"]
+    library_results = client.post(
+        "/search",
+        headers=headers,
+        json={"query": query, "top_k": 3, "min_score": -1.0},
+    ).json()["results"]
+
+    for results in (document_results, library_results):
+        assert results[0]["snippet"] == query
+        for result in results:
+            exact = float(embedder._vector(result["snippet"]) @ embedder._vector(query))
+            assert result["score"] == pytest.approx(exact, abs=1e-5)